@@ -30,10 +30,18 @@ OTHER DEALINGS IN THE SOFTWARE.
 
 import struct
 import itertools
+import re
 import string
+import array
+import operator
+import bisect
+import binascii
+import hashlib
+import collections
 
-class coe_type:
+class coe_type(object):
     def __init__(self, pdo_bitsize, sdo_bitsize, cdef, coetype, ctype, pyformat):
+        self.name = None    # the coe_types key, set below
         self.pdo_bitsize = pdo_bitsize
         self.sdo_bitsize = sdo_bitsize
         self.cdef = cdef
@@ -41,6 +49,10 @@ class coe_type:
         self.ctype = ctype
         self.pyformat = pyformat
 
+    def __reduce__(self):
+        # Unpickle to the shared descriptor of the same name
+        return (lookup_btype, (self.name,))
+
 # Valid Basic Data types for this application. 
 # See ETG.2000 section 7 table 7
 # See ETG.1000.6 5.6.7.3
@@ -72,10 +84,58 @@ coe_types = {
     'DINT':         coe_type(32,32,'INTEGER32',      4, 'int32_t %s',     'l'),
     'UDINT':        coe_type(32,32,'UNSIGNED32',     7, 'uint32_t %s',    'L'),
     'REAL':         coe_type(32,32,'REAL32',         8, 'float %s',       'f'),
-    'STRING(5)':    coe_type(40,40,'VISIBLESTRING',  9, 'char *%s',      '5s'),
-    'STRING(8)':    coe_type(64,64,'VISIBLESTRING',  9, 'char *%s',      '8s'),
-    'STRING(10)':   coe_type(80,80,'VISIBLESTRING',  9, 'char *%s',      '10s')
+    'LINT':         coe_type(64,64,'INTEGER64',   0x15, 'int64_t %s',     'q'),
+    'ULINT':        coe_type(64,64,'UNSIGNED64',  0x1b, 'uint64_t %s',    'Q'),
+    'LREAL':        coe_type(64,64,'REAL64',      0x11, 'double %s',      'd'),
+}
+
+# Suffixes of integer constants of the 64 bit C types
+c_int_suffixes = {
+    'int64_t %s':   'LL',
+    'uint64_t %s':  'ULL',
+}
+
+# Parametric types NAME(n) of n bytes: (cdef, coetype, ctype). Types of this
+# form are added to coe_types on first lookup.
+parametric_types = {
+    'STRING':       ('VISIBLESTRING',   9, 'char *%s'),
+    'OCTET_STRING': ('OCTETSTRING',  0x0a, 'uint8_t %%s[%d]'),
 }
+parametric_re = re.compile(r'(%s)\((\d+)\)$' % '|'.join(parametric_types))
+
+def make_parametric_type(name, size):
+    """Return a new coe_type for the parametric type name(size)"""
+    cdef, coetype, ctype = parametric_types[name]
+    if '%%' in ctype:
+        ctype = ctype % size
+    return coe_type(8*size, 8*size, cdef, coetype, ctype, '%ds' % size)
+
+for _size in (5, 8, 10):
+    coe_types['STRING(%d)' % _size] = make_parametric_type('STRING', _size)
+
+for _btype, _type in coe_types.iteritems():
+    _type.name = _btype
+
+# Types listed in the ESI DataTypes whether used or not
+builtin_btypes = frozenset(coe_types)
+
+def lookup_btype(btype):
+    """
+    Return the coe_type of basic type name btype, adding parametric types
+    like STRING(16) to coe_types as they are needed. Raises ValueError for
+    a parametric type of size 0.
+    """
+    try:
+        return coe_types[btype]
+    except KeyError:
+        m = parametric_re.match(btype)
+        if m is None:
+            raise
+        if int(m.group(2)) < 1:
+            raise ValueError('Error: %s: the size of %s must be at least 1' % (btype, m.group(1)))
+        _type = make_parametric_type(m.group(1), int(m.group(2)))
+        _type.name = btype
+        return coe_types.setdefault(btype, _type)
 
 def canonical_btype(btype):
     """Return the canonical (ETG conforming) basic type name, or None"""
@@ -87,16 +147,33 @@ def canonical_btype(btype):
         return cbtype
     return None
 
-class coe_sub_object:
+# Access permissions: PREOP SAFEOP OP   PDO
+#                     rw    rw     rw   TR
+def access_string(access_code):
+    """A string representation of access permissions for user display"""
+    s = list("rwrwrwRT")
+    for i,b in enumerate((1,8,2,16,4,32,64,128)):
+        if access_code & b == 0:
+            s[i] = '-'
+    return ''.join(s)
+
+class coe_sub_object(object):
     """A representation of CoE dictionary sub-objects. A sub object always has 
     a parent dictionary object. Sub objects are referenced by their parent 
     object's 16 bit index and a sub object 8 bit index of the form XXXXX:XX 
     (e.g. 7000:10)"""
+    # Large dictionaries hold hundreds of thousands of sub objects, so
+    # they have no per instance __dict__
+    __slots__ = ('index', 'subindex', 'access_code', 'basic_type', 'symbol',
+                 'default', 'description')
+
     def __init__(self, index, subindex, access='r-r-r-', btype='BOOL', symbol='undefined', default=0, description=None):
         self.index = index
         self.subindex = subindex
         self.set_access(access)
-        self.btype = btype
+        # The coe_type, resolved once rather than looked up by name in every
+        # call of the methods below
+        self.basic_type = lookup_btype(btype)
         self.symbol = symbol
         self.default = default
         if description:
@@ -104,6 +181,14 @@ class coe_sub_object:
         else:
             self.description = 'SubIndex %03d' % subindex
         
+    def get_btype(self):
+        return self.basic_type.name
+    btype = property(get_btype, doc='Basic type name (see set_btype)')
+
+    def set_btype(self, btype):
+        """Set the basic type by name"""
+        self.basic_type = lookup_btype(btype)
+
     #0x1c00:00, r-r-r-, usint, 8 bit, "SubIndex 000"
     def __str__(self):
         return ('0x%04x:%02x, %s, %s, %d bit, %s [%#x]' % 
@@ -119,37 +204,39 @@ class coe_sub_object:
         return '#x%04X' % self.index
 
     def coe_reference(self):
-        return self.index << 16 | self.subindex << 8 | self.pdo_bitsize()
+        """The PDO map entry of the sub object: index, subindex and bits"""
+        bits = self.pdo_bitsize()
+        if bits > 0xff:
+            # The length field of a map entry is 8 bits wide
+            raise ValueError('Error: %s %s is %d bits, too large for a PDO map entry' %
+                (self.btype, self.symbol, bits))
+        return self.index << 16 | self.subindex << 8 | bits
 
     def deftype(self):
         "Beckhoff Slave Stack Code CoE type defines"
-        return 'DEFTYPE_'+coe_types[self.btype].cdef
+        return 'DEFTYPE_'+self.basic_type.cdef
         
     def ctype(self):
         "Type used in C language declarations"
-        return coe_types[self.btype].ctype % self.symbol
+        return self.basic_type.ctype % self.symbol
         
     def pdo_bitsize(self):
         "PDO Size of type in bits"
-        return coe_types[self.btype].pdo_bitsize
+        return self.basic_type.pdo_bitsize
     
     def sdo_bitsize(self):
         "SDO Size of type in bits"
-        return coe_types[self.btype].sdo_bitsize
+        return self.basic_type.sdo_bitsize
 
     def is_null(self):
         "True if CoE type is NULL (padding)"
-        return coe_types[self.btype].coetype == 0
+        return self.basic_type.coetype == 0
         
     # Access permissions: PREOP SAFEOP OP   PDO
     #                     rw    rw     rw   TR
     def access(self):
         """A string representation of access permissions for user display"""
-        s = list("rwrwrwRT")
-        for i,b in enumerate((1,8,2,16,4,32,64,128)):
-            if self.access_code & b == 0:
-                s[i] = '-'
-        return ''.join(s)
+        return access_string(self.access_code)
     
     def set_access(self, access):
         """Set permissions as a code (int) or as a permissions string"""
@@ -186,26 +273,214 @@ class coe_sub_object:
         """Return a xs:hexBinary representation of the default value"""
         # Note EtherCAT is a CANOpen derivative, and thus little endian. 
         return ''.join('%02x' % x for x in 
-            bytearray(struct.pack('<'+coe_types[self.btype].pyformat, self.default)))
+            bytearray(struct.pack('<'+self.basic_type.pyformat, self.packable_default())))
+
+    def packable_default(self):
+        """The default as packed by struct: empty for a string type left 0"""
+        if self.default == 0 and self.basic_type.pyformat[-1] == 's':
+            return ''
+        return self.default
      
     def hexdec_default(self):
         """Return a HexDecValue representation of the default value"""
         return '#x%x' % max(0,self.default)
         
     def c_default(self):
-        if isinstance(self.default, int) and self.default>9:
-            return hex(self.default)
+        if self.basic_type.ctype.endswith(']') and not isinstance(self.default, basestring):
+            # Array member, e.g. OCTET_STRING(n)
+            return '{ %s }' % self.default
+        if isinstance(self.default, (int, long)):
+            # 64 bit constants need a suffix in C
+            suffix = c_int_suffixes.get(self.basic_type.ctype, '')
+            if self.default == -2**63:
+                # 0x8000000000000000 does not fit in a signed literal
+                return '(-0x7fffffffffffffff%s - 1)' % suffix
+            if self.default>9:
+                return '%#x%s' % (self.default, suffix)
+            return '%d%s' % (self.default, suffix)
         elif isinstance(self.default, basestring):
             return '"%s"' % self.default
         else:
             return str(self.default)
 
-class merge_specification():
+def _column_property(column, doc):
+    def get(self):
+        return getattr(self.table, column)[self.row]
+    def set(self, value):
+        getattr(self.table, column)[self.row] = value
+    return property(get, set, doc=doc)
+
+class coe_sub_view(coe_sub_object):
+    """A coe_sub_object stored as a row of a sub_table"""
+    __slots__ = ('table', 'row')
+
+    def __init__(self, table, row):
+        self.table = table
+        self.row = row
+
+    def __reduce__(self):
+        # The fields are columns of the table, not slots to be restored
+        return (coe_sub_view, (self.table, self.row))
+
+    index = _column_property('index', 'Parent object index')
+    subindex = _column_property('subindex', 'Sub index')
+    access_code = _column_property('access_code', 'Access bits')
+    symbol = _column_property('symbol', 'Symbol')
+    default = _column_property('default', 'Default value')
+    description = _column_property('description', 'Description')
+
+    def get_basic_type(self):
+        return self.table.types[self.table.btype_id[self.row]]
+    def set_basic_type(self, basic_type):
+        self.table.btype_id[self.row] = self.table.type_id(basic_type)
+    basic_type = property(get_basic_type, set_basic_type, doc='coe_type')
+
+    def __eq__(self, other):
+        return (isinstance(other, coe_sub_view) and
+            self.table is other.table and self.row == other.row)
+    def __ne__(self, other):
+        return not self == other
+    def __hash__(self):
+        return hash((id(self.table), self.row))
+
+class sub_table(object):
+    """
+    Columnar storage for sub objects: one typed array (or list, for values
+    of any type) per field, instead of one instance per sub object. A
+    single table holds the sub objects of a whole dictionary; each object
+    refers to its rows through a sub_slice.
+    """
+    __slots__ = ('index', 'subindex', 'access_code', 'btype_id',
+                 'symbol', 'default', 'description', 'types')
+
+    def __init__(self):
+        # The btype_id column holds indexes into types
+        self.types = []
+        self.index = array.array('H')
+        self.subindex = array.array('H')
+        self.access_code = array.array('I')
+        self.btype_id = array.array('H')
+        self.symbol = []
+        self.default = []
+        self.description = []
+
+    def append(self, so):
+        """Append a row holding the fields of sub object so"""
+        self.index.append(so.index)
+        self.subindex.append(so.subindex)
+        self.access_code.append(so.access_code)
+        self.btype_id.append(self.type_id(so.basic_type))
+        self.symbol.append(so.symbol)
+        self.default.append(so.default)
+        self.description.append(so.description)
+
+    def __len__(self):
+        return len(self.index)
+
+    def type_id(self, basic_type):
+        """Return the btype_id of coe_type basic_type"""
+        try:
+            return self.types.index(basic_type)
+        except ValueError:
+            self.types.append(basic_type)
+            return len(self.types) - 1
+
+    def type_sizes(self, attr):
+        """coe_type attr (e.g. 'pdo_bitsize') of each basic type, by btype_id"""
+        return [getattr(basic_type, attr) for basic_type in self.types]
+
+class sub_slice(object):
+    """
+    The sub objects of a coe_object stored as rows start to stop of a
+    sub_table. Indexing and iteration return coe_sub_views of the rows, so
+    a sub_slice can stand in for the subs list, except that rows cannot be
+    added or removed. The aggregates run over the columns with builtins.
+    """
+    __slots__ = ('table', 'start', 'stop')
+
+    def __init__(self, table, start, stop):
+        self.table = table
+        self.start = start
+        self.stop = stop
+
+    def __len__(self):
+        return self.stop - self.start
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [coe_sub_view(self.table, self.start + row)
+                    for row in xrange(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError('sub_slice index out of range')
+        return coe_sub_view(self.table, self.start + i)
+
+    def __iter__(self):
+        table = self.table
+        return (coe_sub_view(table, row) for row in xrange(self.start, self.stop))
+
+    def __repr__(self):
+        return repr(list(self))
+
+    def column(self, name):
+        """Copy of the rows of column name"""
+        return getattr(self.table, name)[self.start:self.stop]
+
+    def max_subindex(self):
+        return max(itertools.chain((0,), self.column('subindex')))
+
+    def bitsizes(self, attr):
+        """coe_type attr (e.g. 'sdo_bitsize') of each row"""
+        return map(self.table.type_sizes(attr).__getitem__, self.column('btype_id'))
+
+class coe_layout(object):
+    """
+    Cumulative SDO and PDO bit offsets of the sub objects of a coe_object
+    in subindex order, so that offsets and sizes are looked up rather than
+    summed over the preceding sub objects (see coe_object.layout).
+    """
+    __slots__ = ('count', 'subindexes', 'sdo_offsets', 'pdo_offsets')
+
+    def __init__(self, subs):
+        if isinstance(subs, sub_slice):
+            rows = zip(subs.column('subindex'), subs.bitsizes('sdo_bitsize'),
+                       subs.bitsizes('pdo_bitsize'))
+        else:
+            rows = [(so.subindex, so.sdo_bitsize(), so.pdo_bitsize()) for so in subs]
+        rows.sort(key=operator.itemgetter(0))
+        self.count = len(rows)
+        self.subindexes = [row[0] for row in rows]
+        # offsets[i] is the size of the first i sub objects
+        self.sdo_offsets = [0]
+        self.pdo_offsets = [0]
+        for subindex, sdo_bitsize, pdo_bitsize in rows:
+            self.sdo_offsets.append(self.sdo_offsets[-1] + sdo_bitsize)
+            self.pdo_offsets.append(self.pdo_offsets[-1] + pdo_bitsize)
+
+    def sdo_bitoffset(self, subindex):
+        """SDO size of the sub objects below subindex"""
+        return self.sdo_offsets[bisect.bisect_left(self.subindexes, subindex)]
+
+    def pdo_bitoffset(self, subindex):
+        """PDO size of the sub objects below subindex"""
+        return self.pdo_offsets[bisect.bisect_left(self.subindexes, subindex)]
+
+    def sdo_bitsize(self):
+        return self.sdo_offsets[-1]
+
+    def pdo_data_bitsize(self):
+        """PDO size of the sub objects past subindex 0"""
+        return self.pdo_offsets[-1] - self.pdo_bitoffset(1)
+
+class merge_specification(object):
     """
     This class consolidates information concerning RECORDs which share the
     same typedef struct and are implemented as arrays in C. The records 
     appears as discrete PDOs in CoE
     """
+    __slots__ = ('members', 'base_name', 'size', 'index')
+
     def __init__(self, members, base_name, size, index):
         self.members = members  # List of coe_object members of this merge
         self.base_name = base_name
@@ -228,7 +503,27 @@ class merge_specification():
         """CoE symbol of the PDO"""
         return '%s_%d' % (self.base_name, self.index)
 
-class coe_object():
+# Default encoders by tuple of struct formats, see default_encoder()
+_default_encoders = {}
+
+def default_encoder(pyformats):
+    """
+    Return (packer, offsets, strings) for the defaults of sub objects with
+    the struct formats pyformats: a precompiled little endian struct.Struct
+    packing all of them, the byte offset of each within the result (plus
+    the end offset) and the positions of the string types. Encoders are
+    shared by all objects with the same sub object types.
+    """
+    encoder = _default_encoders.get(pyformats)
+    if encoder is None:
+        offsets = [0]
+        for f in pyformats:
+            offsets.append(offsets[-1] + struct.calcsize('<'+f))
+        strings = [i for i, f in enumerate(pyformats) if f[-1] == 's']
+        encoder = _default_encoders[pyformats] = (struct.Struct('<'+''.join(pyformats)), offsets, strings)
+    return encoder
+
+class coe_object(object):
     """A representation of CoE objects. An object can be an array, variable, or
     record. In any event, the object always aggregates one or more subobjects
     where data is actually stored. In the case of a variable, only one subobject
@@ -242,6 +537,10 @@ class coe_object():
     oc_record = 9   
     
     oc_names_ = {7:'variable',8:'array',9:'record'}
+
+    __slots__ = ('object_code', 'index', 'symbol', 'description', 'merge',
+                 '_subs', '_layout', 'properties', 'default', 'default_access',
+                 'array_size', 'data_type')
     
     def __init__(self, object_code=0, index=0, symbol=None, description=None):
         self.object_code = object_code
@@ -250,12 +549,44 @@ class coe_object():
         self.description = description
         self.merge = None
         
-        # Sub objects
-        self.subs = []
+        # Sub objects (see the subs property)
+        self._subs = []
+        self._layout = None
         
         # Arbitrary configuration properties
         self.properties = {}
+
+        # Value of a plain reference to the object (set for variables)
+        self.default = 0
+        # Access bits or'ed into those of the sub objects
+        self.default_access = 0
+        # Element count (set for arrays)
+        self.array_size = 0
+        # ESI data type name (set by coe_gen_xml for arrays and records)
+        self.data_type = None
         
+    def get_subs(self):
+        return self._subs
+    def set_subs(self, subs):
+        self._subs = subs
+        self._layout = None
+    subs = property(get_subs, set_subs, doc='Sub objects: a list, or a sub_slice')
+
+    def layout(self):
+        """
+        Return the coe_layout of the sub objects. It is computed on first
+        use, and again after subs is replaced or changes length; call
+        invalidate_layout() after changing the type or subindex of a sub
+        object in place.
+        """
+        layout = self._layout
+        if layout is None or layout.count != len(self._subs):
+            layout = self._layout = coe_layout(self._subs)
+        return layout
+
+    def invalidate_layout(self):
+        self._layout = None
+
     def is_variable(self):
         """True if this object is of CoE VARIABLE type"""
         return self.object_code == coe_object.oc_variable
@@ -297,9 +628,9 @@ class coe_object():
                 else:
                     so.set_access(a.pop(0))
                 if 'btype' in kwargs:
-                    so.btype = kwargs['btype']
+                    so.set_btype(kwargs['btype'])
                 else:
-                    so.btype = a.pop(0)
+                    so.set_btype(a.pop(0))
                 if 'symbol' in kwargs:
                     so.symbol = kwargs['symbol']
                 else:
@@ -333,9 +664,9 @@ class coe_object():
                 else:
                     so.set_access('------')
                 if 'btype' in kwargs:
-                    so.btype = kwargs['btype']
+                    so.set_btype(kwargs['btype'])
                 else:
-                    so.btype = 'USINT'
+                    so.set_btype('USINT')
                 if 'symbol' in kwargs:
                     so.symbol = kwargs['symbol']
                 else:
@@ -358,7 +689,7 @@ class coe_object():
             if 'access' in kwargs:
                 so.set_access(kwargs['access'])
             if 'btype' in kwargs:
-                so.btype = kwargs['btype']
+                so.set_btype(kwargs['btype'])
             if 'symbol' in kwargs:
                 so.symbol = kwargs['symbol']
             if 'default' in kwargs:
@@ -376,10 +707,48 @@ class coe_object():
         "Index in EtherCATInfo XML hex format"
         return '#x%04X' % self.index
     
+    def compact(self, table=None):
+        """
+        Switch the sub objects to columnar storage, appending them to table
+        (a new sub_table if None). See sub_slice.
+        """
+        if isinstance(self.subs, sub_slice):
+            return
+        if table is None:
+            table = sub_table()
+        start = len(table)
+        for so in self.subs:
+            table.append(so)
+        self.subs = sub_slice(table, start, len(table))
+
     def max_subindex(self):
         """Return the maximum configured sub index"""
+        if isinstance(self.subs, sub_slice):
+            return self.subs.max_subindex()
         return max(itertools.chain((0,), (x.subindex for x in self.subs)))
     
+    def pack_defaults(self):
+        """
+        Return (data, offsets): the little endian encoding of the defaults
+        of all sub objects, packed by one precompiled struct.Struct, and the
+        byte offsets of the sub objects within data (plus the end offset).
+        Bit types take a whole byte each, as in hexbinary_default().
+        """
+        packer, offsets, strings = default_encoder(tuple(so.basic_type.pyformat for so in self.subs))
+        values = [so.default for so in self.subs]
+        for i in strings:
+            values[i] = self.subs[i].packable_default()
+        return packer.pack(*values), offsets
+
+    def hexbinary_defaults(self):
+        """
+        Return the xs:hexBinary representations of the defaults of the sub
+        objects (see coe_sub_object.hexbinary_default)
+        """
+        data, offsets = self.pack_defaults()
+        hexdata = binascii.hexlify(data)
+        return [hexdata[2*offsets[i]:2*offsets[i+1]] for i in xrange(len(offsets)-1)]
+
     def hex_defaults(self):
         """Return a comma delimited list of hex default values suitable for
         use in a C-style initializer statement
@@ -388,20 +757,27 @@ class coe_object():
         
     def pdo_data_bitsize(self):
         "Return size of PDO data (excluding subindex 0)"
-        return sum(so.pdo_bitsize() for so in self.subs if so.subindex>0)
+        return self.layout().pdo_data_bitsize()
         
     def sdo_bitsize(self):
         """
         Return the total SDO size in bits including all padding and workarounds
         """
-        return sum(so.sdo_bitsize() for so in self.subs)        
+        return self.layout().sdo_bitsize()
 
     def sdo_bitoffset(self, subindex):
         """
         Return the offset in bits within the SDO memory object of the 
         specified sub object
         """
-        return sum(x.sdo_bitsize() for x in self.subs if x.subindex<subindex)
+        return self.layout().sdo_bitoffset(subindex)
+
+    def pdo_bitoffset(self, subindex):
+        """
+        Return the offset in bits of the specified sub object within the
+        PDO data of all sub objects
+        """
+        return self.layout().pdo_bitoffset(subindex)
         
     def deftype(self):
         """Return a string containing the cdef type symbol (e.g. 'UNSIGNED8')
@@ -450,11 +826,338 @@ def make_pdo_map(index,pdo):
     pmap.add(*mapz, access='r-r-r-', btype='UDINT')
     return pmap
 
+class coe_dictionary(list):
+    """
+    The list of coe_objects of a mesi file, indexed by object index, by
+    (index, subindex) and by symbol. Like a scan of the list, lookups
+    return the first match. All list operations may be used; the indexes
+    are kept up to date on append and extend, and rebuilt on first use
+    after any other change. Objects must not change index or symbol once
+    added.
+    """
+    def __init__(self, objs=()):
+        list.__init__(self, objs)
+        self.invalidate()
+
+    def __reduce__(self):
+        # Rebuild through __init__, which sets up the indexes
+        return (coe_dictionary, (list(self),))
+
+    def invalidate(self):
+        """Drop the indexes, to be rebuilt on next use"""
+        self._by_index = None
+        self._by_symbol = None
+        self._subs = {}
+        self._sorted = None
+
+    def _index_obj(self, obj):
+        self._by_index.setdefault(obj.index, obj)
+        self._by_symbol.setdefault(obj.symbol, obj)
+
+    def _build(self):
+        self._by_index = {}
+        self._by_symbol = {}
+        for obj in self:
+            self._index_obj(obj)
+
+    def append(self, obj):
+        list.append(self, obj)
+        if self._by_index is not None:
+            self._index_obj(obj)
+        self._sorted = None
+
+    def extend(self, objs):
+        start = len(self)
+        list.extend(self, objs)
+        if self._by_index is not None:
+            for obj in self[start:]:
+                self._index_obj(obj)
+        self._sorted = None
+
+    def find(self, index):
+        """Return the object with index, or None"""
+        if self._by_index is None:
+            self._build()
+        return self._by_index.get(index)
+
+    def find_symbol(self, symbol):
+        """Return the object named symbol, or None"""
+        if self._by_index is None:
+            self._build()
+        return self._by_symbol.get(symbol)
+
+    def find_sub(self, index, subindex):
+        """Return sub object index:subindex, or None"""
+        obj = self.find(index)
+        if obj is None:
+            return None
+        # The sub objects of an object are indexed on first lookup, and
+        # again whenever its subs list was replaced or changed size
+        subs = obj.subs
+        entry = self._subs.get(index)
+        if entry is None or entry[0] is not subs or entry[1] != len(subs):
+            by_subindex = {}
+            for so in subs:
+                by_subindex.setdefault(so.subindex, so)
+            entry = self._subs[index] = (subs, len(subs), by_subindex)
+        return entry[2].get(subindex)
+
+    def compact(self):
+        """Switch all objects to columnar sub object storage in one table"""
+        table = sub_table()
+        for obj in self:
+            obj.compact(table)
+        self._subs = {}
+
+    def sorted_objects(self):
+        """Return the objects ordered by index"""
+        if self._sorted is None:
+            self._sorted = sorted(self, key=lambda obj: obj.index)
+        return self._sorted
+
+def _invalidating(name):
+    method = getattr(list, name)
+    def invalidating(self, *args, **kwargs):
+        result = method(self, *args, **kwargs)
+        self.invalidate()
+        return result
+    invalidating.__name__ = name
+    invalidating.__doc__ = method.__doc__
+    return invalidating
+
+for _name in ('__setitem__', '__delitem__', '__setslice__', '__delslice__',
+              '__iadd__', '__imul__', 'insert', 'pop', 'remove', 'reverse', 'sort'):
+    setattr(coe_dictionary, _name, _invalidating(_name))
+
 def find_obj_by_index(coe_dict, index):
+    if isinstance(coe_dict, coe_dictionary):
+        return coe_dict.find(index)
     return next((obj for obj in coe_dict if obj.index==index), None)
 
 def find_by_map_loc(coe_dict, map_loc):
+    if isinstance(coe_dict, coe_dictionary):
+        return coe_dict.find_sub(map_loc>>16, (map_loc>>8) & 0xff)
     so = next((so for so in find_obj_by_index(coe_dict, map_loc>>16).subs if so.subindex==((map_loc>>8) & 0xff)), None)
     #print 'find by map',so.symbol,so.bitsize()
     return so
-    
\ No newline at end of file
+
+class pdo_map_entry(object):
+    """
+    An entry of a PDO map: the map sub object, the sub object it maps and
+    the offset in bits of the latter within the process image
+    """
+    __slots__ = ('map_sub', 'target', 'bitoffset')
+
+    def __init__(self, map_sub, target, bitoffset):
+        self.map_sub = map_sub
+        self.target = target
+        self.bitoffset = bitoffset
+
+class pdo_mapping(object):
+    """
+    The RxPDO (0x16xx) and TxPDO (0x1Axx) maps of a dictionary, with their
+    entries resolved to the mapped sub objects once rather than by every
+    generator. The process image of each direction holds the entries of
+    its maps in dictionary order.
+    """
+    rx_maps = 0x1600
+    tx_maps = 0x1a00
+
+    def __init__(self, coe_dict):
+        # map base -> [(map object, [pdo_map_entry])]
+        self._maps = {pdo_mapping.rx_maps:[], pdo_mapping.tx_maps:[]}
+        self._by_index = {}
+        bitsizes = {pdo_mapping.rx_maps:0, pdo_mapping.tx_maps:0}
+        for obj in coe_dict:
+            base = obj.index & 0xff00
+            if base not in self._maps:
+                continue
+            entries = []
+            for mso in obj.subs[1:]:
+                so = find_by_map_loc(coe_dict, mso.default)
+                if so is None:
+                    raise ValueError('Error: PDO map entry 0x%04x:%02x maps undefined 0x%04x:%02x' %
+                        (obj.index, mso.subindex, mso.default>>16, (mso.default>>8) & 0xff))
+                entries.append(pdo_map_entry(mso, so, bitsizes[base]))
+                bitsizes[base] += so.pdo_bitsize()
+            self._maps[base].append((obj, entries))
+            self._by_index.setdefault(obj.index, entries)
+        self._bitsizes = bitsizes
+
+    def maps(self, base):
+        """Return the (map object, entries) of the maps of base 0x1600 or 0x1a00"""
+        return self._maps[base]
+
+    def entries(self, index):
+        """Return the entries of the map object index"""
+        return self._by_index.get(index, [])
+
+    def mapped(self, base):
+        """Return the entries of all maps of base 0x1600 or 0x1a00"""
+        return [entry for obj, entries in self._maps[base] for entry in entries]
+
+    def bitsize(self, base):
+        """Return the size in bits of the process image of the maps of base"""
+        return self._bitsizes[base]
+    
+# Immutable copies of the dictionary objects, for digests and diffs
+
+frozen_sub_object = collections.namedtuple('frozen_sub_object',
+    'index subindex access_code btype symbol default description')
+
+def freeze_sub(so):
+    """Return an immutable copy of sub object so"""
+    return frozen_sub_object(so.index, so.subindex, so.access_code, so.btype,
+        so.symbol, so.default, so.description)
+
+class frozen_object(object):
+    """
+    An immutable copy of a coe_object, made by freeze(). Its digest is a
+    hash of its content (the data_type set by coe_gen_xml excepted), so two
+    frozen objects with the same digest are interchangeable. The merge is a
+    (base_name, size, index) tuple, the members being the objects with the
+    same base_name.
+    """
+    fields = ('object_code', 'index', 'symbol', 'description', 'subs',
+              'properties', 'merge', 'default', 'default_access', 'array_size')
+    __slots__ = fields + ('digest',)
+
+    def __init__(self, **kwargs):
+        for name in frozen_object.fields:
+            object.__setattr__(self, name, kwargs[name])
+        key = tuple(getattr(self, name) for name in frozen_object.fields)
+        object.__setattr__(self, 'digest', hashlib.sha1(repr(key)).hexdigest())
+
+    @staticmethod
+    def freeze(obj):
+        """Return an immutable copy of coe_object obj"""
+        merge = obj.merge
+        return frozen_object(object_code=obj.object_code, index=obj.index,
+            symbol=obj.symbol, description=obj.description,
+            subs=tuple(freeze_sub(so) for so in obj.subs),
+            properties=tuple(sorted(obj.properties.items())),
+            merge=merge and (merge.base_name, merge.size, merge.index),
+            default=obj.default, default_access=obj.default_access,
+            array_size=obj.array_size)
+
+    def __setattr__(self, name, value):
+        raise AttributeError('frozen_object is immutable')
+
+    def __eq__(self, other):
+        return isinstance(other, frozen_object) and self.digest == other.digest
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash(self.digest)
+
+    def __reduce__(self):
+        return (_frozen_object, (tuple(getattr(self, name) for name in frozen_object.fields),))
+
+    def __repr__(self):
+        return 'frozen_object(index=0x%04x, symbol=%r, digest=%s)' % (
+            self.index, self.symbol, self.digest)
+
+def _frozen_object(values):
+    return frozen_object(**dict(zip(frozen_object.fields, values)))
+
+# Structural differences between dictionaries
+
+# kind is 'added', 'removed' or 'changed'. subindex is None for changes of
+# the object itself, field is None for added and removed objects and sub
+# objects, old and new are the frozen objects, frozen sub objects or field
+# values.
+dict_change = collections.namedtuple('dict_change', 'kind index subindex field old new')
+
+def frozen_objects(objs):
+    """Return objs, coe_objects or frozen_objects, as frozen_objects"""
+    return [obj if isinstance(obj, frozen_object) else frozen_object.freeze(obj) for obj in objs]
+
+def diff_objects(old, new):
+    """Return the dict_changes from frozen object old to new"""
+    index = new.index
+    changes = []
+    for field in ('object_code', 'symbol', 'description', 'merge', 'default',
+                  'default_access', 'array_size'):
+        if getattr(old, field) != getattr(new, field):
+            changes.append(dict_change('changed', index, None, field,
+                getattr(old, field), getattr(new, field)))
+    old_props, new_props = dict(old.properties), dict(new.properties)
+    for key in sorted(set(old_props) | set(new_props)):
+        if old_props.get(key) != new_props.get(key):
+            changes.append(dict_change('changed', index, None, 'properties.'+key,
+                old_props.get(key), new_props.get(key)))
+
+    old_subs = dict((so.subindex, so) for so in reversed(old.subs))
+    new_subs = dict((so.subindex, so) for so in reversed(new.subs))
+    for subindex in sorted(set(old_subs) | set(new_subs)):
+        old_so, new_so = old_subs.get(subindex), new_subs.get(subindex)
+        if old_so == new_so:
+            continue
+        if old_so is None:
+            changes.append(dict_change('added', index, subindex, None, None, new_so))
+        elif new_so is None:
+            changes.append(dict_change('removed', index, subindex, None, old_so, None))
+        else:
+            for field in frozen_sub_object._fields[2:]:
+                if getattr(old_so, field) != getattr(new_so, field):
+                    changes.append(dict_change('changed', index, subindex, field,
+                        getattr(old_so, field), getattr(new_so, field)))
+    return changes
+
+def diff_dicts(old, new):
+    """
+    Return the dict_changes from the objects old to the objects new, in
+    index order. Objects are matched by index and sub objects by subindex.
+    Each side may hold coe_objects or frozen_objects; objects with the same
+    digest are skipped without comparing their content.
+    """
+    old_objs, new_objs = {}, {}
+    for objs, frozen in ((old_objs, old), (new_objs, new)):
+        for obj in reversed(frozen_objects(frozen)):
+            objs[obj.index] = obj
+    changes = []
+    for index in sorted(set(old_objs) | set(new_objs)):
+        old_obj, new_obj = old_objs.get(index), new_objs.get(index)
+        if old_obj is None:
+            changes.append(dict_change('added', index, None, None, None, new_obj))
+        elif new_obj is None:
+            changes.append(dict_change('removed', index, None, None, old_obj, None))
+        elif old_obj.digest != new_obj.digest:
+            changes += diff_objects(old_obj, new_obj)
+    return changes
+
+def format_mapping(map_loc):
+    """Format a PDO mapping entry as index:subindex/bits"""
+    return '0x%04x:%02x/%d' % (map_loc>>16, (map_loc>>8) & 0xff, map_loc & 0xff)
+
+def format_default(index, subindex, value):
+    """Format the default of a sub object, as a mapping entry in PDO maps"""
+    if subindex and (index>>8) in (0x16, 0x1a) and isinstance(value, (int, long)):
+        return format_mapping(value)
+    return repr(value)
+
+def format_change(change):
+    """Return a one line description of dict_change change"""
+    if change.subindex is None:
+        location = '0x%04x' % change.index
+    else:
+        location = '0x%04x:%02x' % (change.index, change.subindex)
+    if change.kind != 'changed':
+        item = change.new or change.old
+        sign = '+' if change.kind == 'added' else '-'
+        if change.subindex is None:
+            return '%s %s %s (%s, %d sub objects)' % (sign, location, item.symbol,
+                coe_object.oc_names_.get(item.object_code, item.object_code), len(item.subs))
+        return '%s %s %s %s %s = %s' % (sign, location, item.symbol, item.btype,
+            access_string(item.access_code), format_default(change.index, change.subindex, item.default))
+    old, new = change.old, change.new
+    if change.field == 'access_code':
+        old, new = access_string(old), access_string(new)
+    elif change.field == 'default':
+        old = format_default(change.index, change.subindex, old)
+        new = format_default(change.index, change.subindex, new)
+    else:
+        old, new = repr(old), repr(new)
+    return '~ %s %s: %s -> %s' % (location, change.field, old, new)
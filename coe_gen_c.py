@@ -31,6 +31,9 @@ import pystache
 import os
 import time
 from coe_defs import *
+from mesi_file import memoize_on_content
+from mesi_build import write_if_changed, volatile_re
+import mesi_trace
 
 btype_cfg_map = {
     'BOOL':'bit lbloo',
@@ -41,10 +44,14 @@ btype_cfg_map = {
     'DINT':'long _u',
     'UDINT':'long _u',
     'REAL':'float _uf',
+    'LINT':'llong _u',
+    'ULINT':'llong _u',
+    'LREAL':'double _uf',
 }
 
 def subindex_context(pdo):
     # Basic idea
+    layout = pdo.layout()
     subs = [{
                 'subindex':so.subindex,
                 'hex_subindex':('%02x'%so.subindex),
@@ -53,6 +60,8 @@ def subindex_context(pdo):
                 'deftype':so.deftype(),
                 'pdo_bitsize':so.pdo_bitsize(),
                 'sdo_bitsize':so.sdo_bitsize(),
+                'sdo_bitoffset':layout.sdo_bitoffset(so.subindex),
+                'pdo_bitoffset':layout.pdo_bitoffset(so.subindex),
                 'access_code_hex':so.access_code_hex(),
                 'description':so.description,
                 'null?':so.is_null(),
@@ -73,9 +82,10 @@ def subindex_context(pdo):
 
     return subs
     
-def mapped_subindex_context(coe_dict, pdo):
+def mapped_subindex_context(world, pdo):
     if not (pdo.is_rx_pdo_map() or pdo.is_tx_pdo_map()):
         return None
+    coe_dict = world.coe_dict
     
     subs = []
     bit_index = 0
@@ -84,7 +94,7 @@ def mapped_subindex_context(coe_dict, pdo):
     # default value, lookup the referenced object, then build a sub context 
     # for each of those.
     
-    for so in (find_by_map_loc(coe_dict, mso.default) for mso in pdo.subs[1:]):
+    for so in (entry.target for entry in world.pdo_mapping().entries(pdo.index)):
         bit_count = so.pdo_bitsize()
 
         # padding must be explicitly advertised, or TwinCAT will not byte align
@@ -112,8 +122,8 @@ def mapped_subindex_context(coe_dict, pdo):
                 bit_index=0;
                 tx_pdo_code.append('data += 1;')
                 rx_pdo_code.append('data += 1;')
-        elif so.btype.startswith('REAL') or so.btype.startswith('STRING'):
-            # Force byte alignment
+        elif so.basic_type.pyformat[-1] in 'fds':
+            # REAL, LREAL and string types. Force byte alignment
             if bit_index > 0:
                 bit_index=0;
                 tx_pdo_code.append('data += 1;')
@@ -126,6 +136,8 @@ def mapped_subindex_context(coe_dict, pdo):
             rx_pdo_code.append('memcpy(&%s, data, %d);' % (symbol, bit_count/8))            
             rx_pdo_code.append('data += %d;' % (bit_count/8))
         else:
+            # Shifts of 32 bits or more need a 64 bit operand
+            wide = '(uint64_t)' if bit_count > 32 else ''
             while bit_count:
                 if (bit_count >= 8) and bit_index == 0:
                     # aligned bytewise little endian copy
@@ -137,7 +149,7 @@ def mapped_subindex_context(coe_dict, pdo):
                         tx_pdo_code.append('*data++ = %s;'%symbol)
                     
                     if value_shift:
-                        rx_pdo_code.append('%s |= (*data++ << %d);'%(symbol,value_shift))
+                        rx_pdo_code.append('%s |= (%s*data++ << %d);'%(symbol,wide,value_shift))
                     else:
                         rx_pdo_code.append('%s = *data++;'%symbol)
     
@@ -146,11 +158,11 @@ def mapped_subindex_context(coe_dict, pdo):
                     # odd 8 number of bits, bitwise copy
                     bit_count -= 1;
         
-                    tx_pdo_code.append('if (%s & (1 << %d)) *data |= (1 << %d);' % (symbol,value_shift, bit_index))
+                    tx_pdo_code.append('if (%s & (%s1 << %d)) *data |= (1 << %d);' % (symbol,wide,value_shift, bit_index))
                     tx_pdo_code.append('else *data &= ~(1 << %d);' % bit_index)
     
-                    rx_pdo_code.append('if (*data & (1 << %d)) %s |= (1 << %d);' % (bit_index, symbol, value_shift))
-                    rx_pdo_code.append('else %s &= ~(1 << %d);' % (symbol, value_shift))
+                    rx_pdo_code.append('if (*data & (1 << %d)) %s |= (%s1 << %d);' % (bit_index, symbol, wide, value_shift))
+                    rx_pdo_code.append('else %s &= ~(%s1 << %d);' % (symbol, wide, value_shift))
     
                     value_shift += 1
     
@@ -193,9 +205,20 @@ def full_hex_defaults(world, pdo):
         return pdo.hex_defaults()
     return ', '.join('{ %s }' % m.hex_defaults() for m in pdo.merge.members)
 
-def appl_context(world):
+def build_date():
+    """
+    The date stamped on generated files: today, or the date of the
+    SOURCE_DATE_EPOCH environment variable (seconds since 1970, UTC) for
+    reproducible builds
+    """
+    epoch = os.environ.get('SOURCE_DATE_EPOCH')
+    if epoch:
+        return time.strftime("%A, %d %B %Y", time.gmtime(int(epoch)))
+    return time.strftime("%A, %d %B %Y")
+
+def build_appl_context(world):
     # Convert large constants to hex, so we look more nerdy
-    context = dict((k,hex(v) if isinstance(v,int) and 
+    context = dict((k,'%#x' % v if isinstance(v,(int,long)) and 
         (v>9 or v<-9) else v) for k,v in world.settings.iteritems())
         
     context.update({
@@ -207,7 +230,7 @@ def appl_context(world):
             'max_subindex':pdo.max_subindex(),
             'subs': subindex_context(pdo),
             'dsubs': subindex_context(pdo)[1:],  # Data sub objects (less subindex count)
-            'mapped_subs': mapped_subindex_context(world.coe_dict, pdo),
+            'mapped_subs': mapped_subindex_context(world, pdo),
             'description': pdo.description,
             'c_type': (pdo.merge.typename() if pdo.merge else 'TOBJ'+pdo.hex_index()),
             'symbol': pdo.c_symbol(),
@@ -224,22 +247,48 @@ def appl_context(world):
             'merge_size':(pdo.merge.size if pdo.merge != None else ''),
             'merge_index':(pdo.merge.index if pdo.merge != None else ''),
         }.items())) for pdo in world.coe_dict],
-        'date':time.strftime("%A, %d %B %Y"),
+        'date':build_date(),
         'appname':'mesicat.py',
     })
     
     return context
 
+# Memoized, as a mesi file usually renders several templates from the same
+# world. The context is shared, so make() copies it before adding to it.
+appl_context = memoize_on_content(build_appl_context)
+
+# Parts of world read and written by make() (see mesi_build.py)
+reads = ('settings', 'coe_dict')
+writes = ()
+
+def inputs(world, *args):
+    """Files read by make(world, *args): the template"""
+    return [args[0]]
+
+def outputs(world, *args):
+    """Files written by make(world, *args)"""
+    return [args[1]]
+
+def prepare(world, *args):
+    """Build the context shared by the steps before they run in parallel"""
+    appl_context(world)
+
 def make(world, *args):
-    context = appl_context(world)
+    with mesi_trace.span('context', 'template'):
+        context = dict(appl_context(world))
     
     context['basename'] = os.path.basename( args[1] )
     
     #import pprint
     #pprint.pprint(world.settings)
     
-    with open(args[0],'r') as infile:
-        with open(args[1],'w') as out:
-            context['basename'] = os.path.basename( args[1] )
-            out.write(pystache.render(infile.read(), context))
+    with mesi_trace.span('read', 'io', path=args[0]):
+        with open(args[0],'r') as infile:
+            template = infile.read()
+    with mesi_trace.span('render', 'template', template=args[0]):
+        text = pystache.render(template, context)
+    # Files which only differ in their @date are left alone, unless the
+    # date is that of SOURCE_DATE_EPOCH (see build_date)
+    reproducible = os.environ.get('SOURCE_DATE_EPOCH')
+    write_if_changed(args[1], text, volatile=None if reproducible else volatile_re)
         
@@ -31,6 +31,7 @@ import struct
 import string
 import itertools
 from coe_defs import *
+from mesi_build import write_if_changed
 
 sii_area_layout = [ # symbol, default, py struct format (all LE)
     ('pdi_control',         0x0080, 'H'),
@@ -210,6 +211,14 @@ def pack_cat_dc(settings_dict):
 
     return head_n_pad(60, dc_bin)
 
+# Parts of world read and written by make() (see mesi_build.py)
+reads = ('settings',)
+writes = ('settings',)
+
+def outputs(world, *args):
+    """Files written by make(world, *args)"""
+    return ['eeprom.bin']
+
 def make(world, *args):
     # Essentially, many of the settings are inspired by the ecat_def header file
     settings = world.settings
@@ -269,8 +278,7 @@ def make(world, *args):
     eeprom = string.ljust(str(eeprom), settings['ESC_EEPROM_SIZE'], '\xff')    
     
     # Sling to disk
-    with open('eeprom.bin','w') as out:
-        out.write( eeprom )
+    write_if_changed('eeprom.bin', eeprom, binary=True, volatile=None)
     
     # Make an initializer dump for C code generation
     settings['sii_eeprom_initializer'] = cdump(eeprom)
@@ -282,4 +290,4 @@ if __name__ == "__main__":
     
     print 'Expect 0x3c, got',hex(cs)
     
-    
\ No newline at end of file
+    
\ No newline at end of file
@@ -29,9 +29,12 @@ OTHER DEALINGS IN THE SOFTWARE.
 """
 
 import sys
+import cStringIO
 # ethercatinfo was generated by generateDS.py from EtherCATInfo.xsd
 import ethercatinfo as eci
 from coe_defs import *
+from mesi_build import write_if_changed
+import mesi_trace
 
 def hexdecvaluetoint(hdv):
     """Convert HexDecValue to int. Will fail if argument has leading zeroes"""
@@ -43,12 +46,25 @@ def hexdec(i):
     """
     return hex(i).replace('0x','#x')
 
+# Parts of world read and written by make() (see mesi_build.py)
+reads = ('settings', 'coe_dict')
+writes = ('settings', 'coe_dict')     # coe_dict: the objects' data_type
+
+def inputs(world, *args):
+    """Files read by make(world, *args): the reference ESI file"""
+    return [args[0]]
+
+def outputs(world, *args):
+    """Files written by make(world, *args)"""
+    return [args[1]]
+
 def make(world, *args):
     coe_dict = world.coe_dict
     settings = world.settings
     
     "Modify ESI file based on our application dictionary"
-    esi = eci.parse(args[0],silence=True)
+    with mesi_trace.span('read', 'io', path=args[0]):
+        esi = eci.parse(args[0],silence=True)
     
     # Identify Device node
     device = next((n for n in esi.Descriptions.Devices.Device if 
@@ -65,7 +81,7 @@ def make(world, *args):
     def purge_fill_map(pdomap,addr,sm):
         del pdomap[:]
         default_size = 0
-        for pdo_map_entry in (obj for obj in coe_dict if (obj.index&0xff00)==addr):
+        for pdo_map_entry, entries in world.pdo_mapping().maps(addr):
             pdo_xml = eci.PdoType(Mandatory=True, Fixed=True, Sm=str(sm), 
                 Index=eci.IndexType35(valueOf_=pdo_map_entry.xml_index()),
                 Name=[
@@ -73,9 +89,7 @@ def make(world, *args):
                 ])
             
             pdo_xml.Entry = []
-            for mso in pdo_map_entry.subs[1:]:
-                so = find_by_map_loc(coe_dict,mso.default)
-                
+            for so in (entry.target for entry in entries):
                 cbtype = canonical_btype(so.btype)
                 if not cbtype:
                     continue
@@ -118,8 +132,12 @@ def make(world, *args):
         if dtt.Name=='DT1018':
             data_types[dtt.Name] = dtt
     
-    # Insert or update our known Basic types to dictionary
-    for btype,coetype in coe_types.iteritems():
+    # Insert or update our known Basic types to dictionary, and the
+    # parametric types (e.g. STRING(16)) this dictionary uses
+    used = set(so.btype for obj in coe_dict for so in obj.subs)
+    for btype,coetype in coe_types.items():
+        if btype not in builtin_btypes and btype not in used:
+            continue
         cbtype = canonical_btype(btype)
         if not cbtype:
             continue
@@ -144,6 +162,7 @@ def make(world, *args):
     # Loop over our mesi defined objects and create their corresponding types
     for obj in coe_dict:
         name = 'DT%04X' % obj.index
+        layout = obj.layout()
         
         # VARIABLE is ignored, as the type is merely specified as a basic 
         # type in the ObjectType element
@@ -153,10 +172,10 @@ def make(world, *args):
             obj.data_type = name
 
             data_types[name] = eci.DataTypeType(
-                Name=name,BitSize=obj.sdo_bitsize(),SubItem=[
+                Name=name,BitSize=layout.sdo_bitsize(),SubItem=[
                     eci.SubItemType(SubIdx=str(so.subindex), Name=so.description,
                                 Type=canonical_btype(so.btype),BitSize=so.pdo_bitsize(),
-                                BitOffs=obj.sdo_bitoffset(so.subindex), 
+                                BitOffs=layout.sdo_bitoffset(so.subindex), 
                                 Flags=make_flags_type(so) )
                     for so in obj.subs if canonical_btype(so.btype)])
         if obj.is_array():
@@ -166,14 +185,14 @@ def make(world, *args):
             name_arr = name+'ARR'
             so0,so1 = obj.subs[0:2]
             data_types[name] = eci.DataTypeType(
-                Name=name,BitSize=obj.sdo_bitsize(),SubItem=[
+                Name=name,BitSize=layout.sdo_bitsize(),SubItem=[
                     eci.SubItemType(SubIdx='0', Name=so0.description,
                                 Type=canonical_btype(so0.btype),BitSize=so0.pdo_bitsize(),
-                                BitOffs=obj.sdo_bitoffset(0), 
+                                BitOffs=layout.sdo_bitoffset(0), 
                                 Flags=make_flags_type(so0) ),
                     eci.SubItemType(SubIdx=None, Name='Elements',
-                                Type=name_arr,BitSize=obj.pdo_data_bitsize(),
-                                BitOffs=obj.sdo_bitoffset(1), 
+                                Type=name_arr,BitSize=layout.pdo_data_bitsize(),
+                                BitOffs=layout.sdo_bitoffset(1), 
                                 Flags=make_flags_type(so1) )
                 ])
             data_types[name_arr] = eci.DataTypeType(
@@ -222,7 +241,7 @@ def make(world, *args):
                 Name=[eci.NameType(LcId=1033,valueOf_=obj.description)],
                 Type=canonical_btype(so0.btype),
                 BitSize=so0.pdo_bitsize(),
-                Info=eci.ObjectInfoType(DefaultData=so0.hexbinary_default()),
+                Info=eci.ObjectInfoType(DefaultData=obj.hexbinary_defaults()[0]),
                 Flags=make_flags_type24(so0)
             )
     
@@ -235,8 +254,8 @@ def make(world, *args):
                 Info=eci.ObjectInfoType(SubItem=[
                     eci.SubItemType32(
                         Name=so.description, 
-                        Info=eci.ObjectInfoType(DefaultData=so.hexbinary_default())
-                    ) for so in obj.subs]),
+                        Info=eci.ObjectInfoType(DefaultData=default)
+                    ) for so, default in zip(obj.subs, obj.hexbinary_defaults())]),
                 Flags=make_flags_type24(obj.subs[0])
             )
 
@@ -323,7 +342,9 @@ def make(world, *args):
     #print device.Mailbox.exportLiteral(sys.stdout,0)
     
     ### Output modified XML
-    with open(args[1],'w') as outfile:
-        namespacedef = 'xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" xsi:noNamespaceSchemaLocation="EtherCATInfo.xsd"'
+    outfile = cStringIO.StringIO()
+    namespacedef = 'xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" xsi:noNamespaceSchemaLocation="EtherCATInfo.xsd"'
+    with mesi_trace.span('export', 'xml'):
         esi.export(outfile,0,'','EtherCATInfo',namespacedef,False)
-    
\ No newline at end of file
+    write_if_changed(args[1], outfile.getvalue())
+    
\ No newline at end of file
@@ -0,0 +1,242 @@
+# -*- coding: utf-8 -*-
+"""
+mesi_bench.py
+
+Parser benchmarks on synthetic .mesi files of increasing size
+Created on Fri Oct 16 2026
+
+@copyright MIT License
+Copyright (C) 2013 Dynamic Systems Inc.
+Permission is hereby granted, free of charge, to any person obtaining 
+a copy of this software and associated documentation files (the 
+"Software"), to deal in the Software without restriction, including 
+without limitation the rights to use, copy, modify, merge, publish, 
+distribute, sublicense, and/or sell copies of the Software, and to 
+permit persons to whom the Software is furnished to do so, subject to 
+the following conditions:
+The above copyright notice and this permission notice shall be included 
+in all copies or substantial portions of the Software.
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS 
+OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, 
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL 
+THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR 
+OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, 
+ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR 
+OTHER DEALINGS IN THE SOFTWARE.
+"""
+
+import sys
+import getopt
+import timeit
+import itertools
+import pyparsing
+import mesi_file
+import mesi_rd
+import mesi_incremental
+
+def synthetic_mesi(count, subs=16):
+    """
+    Return the source of a generated .mesi file holding count records of
+    subs entries each, plus a variable and an array per record, PDO maps
+    and a PDO assign using wildcard references.
+    """
+    btypes = ('BOOL', 'USINT', 'UINT', 'UDINT', 'REAL')
+    lines = [
+        '// Generated by mesi_bench.py',
+        'VENDOR_ID=0x0000FFFF;',
+        'DEVICE_NAME="Synthetic";',
+    ]
+    for i in xrange(count):
+        index = 0x2000 + 3*i
+        lines.append('record read tx_pdo_mapping rec_%d @%#06x : "Record %d" {' % (i, index, i))
+        for j in xrange(subs):
+            lines.append('    %s entry_%d : "Entry %d";' % (btypes[j % len(btypes)], j, j))
+        lines.append('};')
+        lines.append('UDINT readwrite var_%d @%#06x = %d : "Variable %d";' % (i, index+1, i, i))
+        lines.append('UINT read arr_%d[4] @%#06x : "Array %d" = { 1, 2, 3, var_%d };' % (i, index+2, i, i))
+    for i in xrange(min(count, 0xfe)):
+        lines.append('UDINT read tx_pdo_map_%d[] @%#06x : "Map %d" = { &rec_%d.* };' % (i, 0x1a00+i, i, i))
+    lines.append('UINT read sTxPDOassign[] @0x1c13 : "TxPDO Assignment" = { $tx_pdo_map_* };')
+    return '\n'.join(lines) + '\n'
+
+def best_time(fn, repeat):
+    return min(timeit.repeat(fn, number=1, repeat=repeat))
+
+def world_dump(world):
+    """Comparable representation of a parse result"""
+    return (repr(world.coe_dict), world.make_list, sorted(world.settings.items()),
+        [(obj.properties, obj.merge and (obj.merge.base_name, obj.merge.index))
+         for obj in world.coe_dict])
+
+def bench_packrat(sources, repeat):
+    """
+    Parse with and without pyparsing's packrat mode. enablePackrat() cannot
+    be undone, so the plain parses are timed first; run this mode on its
+    own.
+    """
+    plain = [best_time(lambda: mesi_file.parse(source), repeat) for label, source in sources]
+    pyparsing.ParserElement.enablePackrat()
+    print '%-12s %8s %10s %10s %10s %8s' % ('source', 'lines', 'bytes', 'plain s', 'packrat s', 'ratio')
+    for (label, source), plain_s in zip(sources, plain):
+        packrat = best_time(lambda: mesi_file.parse(source), repeat)
+        print '%-12s %8d %10d %10.3f %10.3f %8.2f' % (label, source.count('\n'), len(source),
+            plain_s, packrat, plain_s/packrat)
+
+def bench_backends(sources, repeat):
+    """
+    Compare the pyparsing and recursive descent backends: syntax analysis
+    alone, and the complete parse() including statement evaluation.
+    """
+    print '%-12s %8s %10s %10s %8s %10s %10s %8s %5s' % ('source', 'lines',
+        'syntax pp', 'syntax rd', 'ratio', 'parse pp', 'parse rd', 'ratio', 'same')
+    body = mesi_file.grammar().body
+    for label, source in sources:
+        syntax_pp = best_time(lambda: body.parseString(source, parseAll=True), repeat)
+        syntax_rd = best_time(lambda: mesi_rd.mesi_rd_parser(source).parse_body(), repeat)
+        parse_pp = best_time(lambda: mesi_file.parse(source), repeat)
+        parse_rd = best_time(lambda: mesi_file.parse(source, backend='rd'), repeat)
+        same = world_dump(mesi_file.parse(source)) == world_dump(mesi_file.parse(source, backend='rd'))
+        print '%-12s %8d %10.3f %10.3f %8.1f %10.3f %10.3f %8.1f %5s' % (label,
+            source.count('\n'), syntax_pp, syntax_rd, syntax_pp/syntax_rd,
+            parse_pp, parse_rd, parse_pp/parse_rd, same)
+
+def edit_middle_statement(source):
+    """Return source with a comment added to its middle statement"""
+    chunks = mesi_file.split_statements(source)
+    offset, text = chunks[len(chunks)/2]
+    end = offset + text.rindex(';')
+    return source[:end] + '/* edited */' + source[end:]
+
+def bench_incremental(sources, repeat):
+    """Full parse of an edited source against an incremental re-parse"""
+    print '%-12s %8s %10s %10s %8s %10s %5s' % ('source', 'lines',
+        'full s', 'incr s', 'ratio', 'evaluated', 'same')
+    for label, source in sources:
+        edited = edit_middle_statement(source)
+        full = best_time(lambda: mesi_file.parse(edited), repeat)
+        def incremental():
+            parser = mesi_incremental.incremental_parser()
+            parser.parse(source)
+            start = timeit.default_timer()
+            world = parser.parse(edited)
+            return timeit.default_timer() - start, parser, world
+        incr, parser, world = min(incremental() for i in xrange(repeat))
+        same = world_dump(world) == world_dump(mesi_file.parse(edited))
+        print '%-12s %8d %10.3f %10.3f %8.1f %10d %5s' % (label, source.count('\n'),
+            full, incr, full/incr, parser.evaluated, same)
+
+def instance_bytes(obj):
+    """Size of obj and of its __dict__, if any"""
+    size = sys.getsizeof(obj)
+    if hasattr(obj, '__dict__'):
+        size += sys.getsizeof(obj.__dict__)
+    return size
+
+def table_bytes(table):
+    """Size of a sub_table and of its columns"""
+    return sys.getsizeof(table) + sum(sys.getsizeof(getattr(table, column))
+        for column in table.__slots__)
+
+def bench_memory(sources, repeat):
+    """
+    Memory held by the coe_objects, sub objects and merge specifications
+    of the parsed dictionary: the size of the instances and their __dict__
+    (not of the attribute values, which are mostly shared), as is and with
+    columnar sub object storage (see result_object.compact), where the
+    instances of the sub objects are replaced by a sub_slice per object and
+    the columns of the sub_table. Also the time to sum the SDO size of all objects, in both
+    forms.
+    """
+    print '%-12s %8s %8s %10s %8s %10s %8s %10s %10s' % ('source', 'objects',
+        'subs', 'kB', 'B/sub', 'compact kB', 'B/sub', 'sdo s', 'compact s')
+    for label, source in sources:
+        world = mesi_file.parse(source, backend='rd')
+        subs = [so for obj in world.coe_dict for so in obj.subs]
+        merges = set(obj.merge for obj in world.coe_dict if obj.merge)
+        size = sum(instance_bytes(x) for x in itertools.chain(world.coe_dict, subs, merges))
+        sdo = lambda objs=world.coe_dict: sum(obj.sdo_bitsize() for obj in objs)
+        sdo_time = best_time(sdo, repeat)
+        world.compact()
+        slices = [obj.subs for obj in world.coe_dict]
+        compact_size = sum(instance_bytes(x) for x in itertools.chain(world.coe_dict, slices, merges))
+        compact_size += table_bytes(slices[0].table)
+        compact_time = best_time(sdo, repeat)
+        print '%-12s %8d %8d %10d %8.1f %10d %8.1f %10.4f %10.4f' % (label,
+            len(world.coe_dict), len(subs), size/1024, float(size)/len(subs),
+            compact_size/1024, float(compact_size)/len(subs), sdo_time, compact_time)
+
+def sub_object_loop(objs):
+    """The per sub object calls of the generators' inner loops"""
+    for obj in objs:
+        for so in obj.subs:
+            so.pdo_bitsize()
+            so.sdo_bitsize()
+            so.deftype()
+            so.ctype()
+            so.is_null()
+            so.hexbinary_default()
+
+def bench_generators(sources, repeat):
+    """
+    Time the sub object methods called by the generators, the encoding of
+    the ESI DefaultData of all sub objects one by one and per object, and
+    the context coe_gen_c builds for its templates
+    """
+    import coe_gen_c
+    print '%-12s %8s %8s %12s %12s %12s %12s' % ('source', 'objects', 'subs',
+        'sub calls s', 'defaults s', 'batch s', 'c context s')
+    for label, source in sources:
+        world = mesi_file.parse(source, backend='rd')
+        objs = world.coe_dict
+        loop = best_time(lambda: sub_object_loop(objs), repeat)
+        defaults = best_time(lambda: [so.hexbinary_default() for obj in objs for so in obj.subs], repeat)
+        batch = best_time(lambda: [obj.hexbinary_defaults() for obj in objs], repeat)
+        context = best_time(lambda: coe_gen_c.build_appl_context(world), repeat)
+        print '%-12s %8d %8d %12.4f %12.4f %12.4f %12.4f' % (label, len(objs),
+            sum(len(obj.subs) for obj in objs), loop, defaults, batch, context)
+
+benchmarks = {
+    'packrat': bench_packrat,
+    'backends': bench_backends,
+    'incremental': bench_incremental,
+    'memory': bench_memory,
+    'generators': bench_generators,
+}
+
+def usage():
+    print sys.argv[0], "[-r repeat] [-m %s] [count|file.mesi ...]" % '|'.join(sorted(benchmarks))
+
+def main():
+    repeat = 3
+    mode = 'backends'
+    sizes = [10, 50, 100, 500, 1000]
+
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], "r:m:")
+    except getopt.GetoptError, err:
+        print str(err)
+        usage()
+        sys.exit(2)
+
+    for o, a in opts:
+        if o == "-r":
+            repeat = int(a)
+        elif o == "-m":
+            if a not in benchmarks:
+                usage()
+                sys.exit(2)
+            mode = a
+
+    # Arguments are either synthetic file sizes or .mesi files
+    sources = []
+    for a in args or sizes:
+        if str(a).isdigit():
+            sources.append(('synth_%s' % a, synthetic_mesi(int(a))))
+        else:
+            with open(a,'r') as infile:
+                sources.append((a, infile.read()))
+
+    benchmarks[mode](sources, repeat)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,428 @@
+# -*- coding: utf-8 -*-
+"""
+mesi_build.py
+
+Incremental execution of the make statements of a parsed .mesi file. A
+build state file next to the .mesi file records what each make step read:
+its module, the files it reads, the settings it looked up and, unless the
+module declares otherwise, the object dictionary. It also records the
+settings the step wrote. A step whose inputs are unchanged and whose outputs
+exist is not run again; its settings writes are replayed instead, much like
+make skips up to date targets.
+
+Make modules describe themselves with optional hooks and attributes:
+    outputs(world, *args)   files written (a step without it always runs)
+    inputs(world, *args)    files read, e.g. templates
+    reads                   parts of world read: 'settings', 'coe_dict'
+    writes                  parts of world written
+    prepare(world, *args)   computes what parallel steps share (see run_level)
+
+The steps form a DAG: a step depends on the earlier steps which write what
+it reads or writes, or read what it writes. Steps which do not depend on
+each other may run in parallel.
+
+Created on Fri Oct 16 2026
+
+@copyright MIT License
+Copyright (C) 2013 Dynamic Systems Inc.
+Permission is hereby granted, free of charge, to any person obtaining
+a copy of this software and associated documentation files (the
+"Software"), to deal in the Software without restriction, including
+without limitation the rights to use, copy, modify, merge, publish,
+distribute, sublicense, and/or sell copies of the Software, and to
+permit persons to whom the Software is furnished to do so, subject to
+the following conditions:
+The above copyright notice and this permission notice shall be included
+in all copies or substantial portions of the Software.
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR
+OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE,
+ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+OTHER DEALINGS IN THE SOFTWARE.
+"""
+
+import os
+import re
+import sys
+import hashlib
+import tempfile
+import importlib
+import collections
+import multiprocessing
+import cPickle as pickle
+import mesi_file
+import mesi_timing
+import mesi_trace
+from coe_defs import frozen_objects
+
+# Layout of the build state file; a file of another version is ignored
+state_version = 1
+
+# Lines of generated files which change from run to run for the same input
+volatile_re = re.compile(r'^.*@date\b.*$', re.M)
+
+def write_if_changed(path, content, binary=False, volatile=volatile_re):
+    """
+    Write content to path, unless the file already holds the same content
+    (lines matching volatile aside), so that the files which depend on it
+    are not rebuilt for nothing. Returns True if the file was written.
+    """
+    with mesi_trace.span('write', 'io', path=path):
+        return _write_if_changed(path, content, binary, volatile)
+
+def _write_if_changed(path, content, binary, volatile):
+    try:
+        with open(path, 'rb' if binary else 'r') as infile:
+            old = infile.read()
+    except IOError:
+        old = None
+    if old is not None:
+        if old == content:
+            return False
+        if volatile is not None and volatile.sub('', old) == volatile.sub('', content):
+            return False
+    with open(path, 'wb' if binary else 'w') as out:
+        out.write(content)
+    return True
+
+class missing_value(object):
+    """The value of a setting which is not defined"""
+    def __reduce__(self):
+        # Unpickle to the shared instance
+        return 'missing'
+    def __repr__(self):
+        return 'missing'
+
+missing = missing_value()
+
+class recording_settings(collections.MutableMapping):
+    """
+    Stands in for world.settings while a make step runs, recording the
+    keys the step looks up and the keys it changes. A step which iterates
+    over the settings, or takes their number, depends on all of them.
+    """
+    def __init__(self, settings):
+        self.settings = settings
+        self.read = set()
+        self.written = set()
+        self.iterated = False
+
+    def __getitem__(self, key):
+        self.read.add(key)
+        return self.settings[key]
+
+    def __setitem__(self, key, value):
+        self.written.add(key)
+        self.settings[key] = value
+
+    def __delitem__(self, key):
+        self.written.add(key)
+        del self.settings[key]
+
+    def __iter__(self):
+        self.iterated = True
+        self.read.update(self.settings)
+        return iter(self.settings)
+
+    def __len__(self):
+        self.iterated = True
+        return len(self.settings)
+
+def module_digest(mod):
+    """Digest of the source of module mod"""
+    path = mod.__file__
+    if path.endswith(('.pyc', '.pyo')) and os.path.exists(path[:-1]):
+        path = path[:-1]
+    return mesi_file.file_digest(path)
+
+class step_record():
+    """What one make step read and wrote when it last ran"""
+    def __init__(self, fingerprint, dict_digest, outputs):
+        # Digest of the module, its arguments and its input files
+        self.fingerprint = fingerprint
+        # Digest of coe_dict, or None if the step does not read it
+        self.dict_digest = dict_digest
+        self.outputs = outputs
+        self.reads = {}         # setting -> value before the step
+        self.keys = None        # all settings before the step, if iterated
+        self.writes = {}        # setting -> value after the step, or missing
+
+    def valid(self, world, fingerprint, dict_digest):
+        """True if the step would read the same inputs from world"""
+        if fingerprint != self.fingerprint:
+            return False
+        if self.dict_digest is not None and dict_digest() != self.dict_digest:
+            return False
+        if not all(os.path.exists(f) for f in self.outputs):
+            return False
+        settings = world.settings
+        if self.keys is not None and frozenset(settings) != self.keys:
+            return False
+        return all(settings.get(k, missing) == v for k, v in self.reads.iteritems())
+
+    def replay(self, world):
+        """Apply the settings writes of the step to world"""
+        for k, v in self.writes.iteritems():
+            if v is missing:
+                world.settings.pop(k, None)
+            else:
+                world.settings[k] = v
+
+class build_state():
+    """
+    The step_records of the make statements of one .mesi file, stored in
+    path (by default the .mesi file name plus '.build')
+    """
+    def __init__(self, filename, path=None):
+        self.path = path or filename + '.build'
+        self.records = {}
+
+    def load(self):
+        try:
+            with open(self.path, 'rb') as infile:
+                state = pickle.load(infile)
+        except IOError:
+            return
+        except Exception:
+            # Truncated or from another version: build everything
+            return
+        if state.get('version') == (mesi_file.__version__, state_version):
+            self.records = state['records']
+
+    def save(self):
+        # Write to a temporary file and rename, as mesi_cache does
+        fd, tmpname = tempfile.mkstemp(suffix='.tmp', dir=os.path.dirname(os.path.abspath(self.path)))
+        try:
+            with os.fdopen(fd, 'wb') as out:
+                pickle.dump({'version':(mesi_file.__version__, state_version), 'records':self.records},
+                    out, pickle.HIGHEST_PROTOCOL)
+            os.rename(tmpname, self.path)
+        except:
+            os.remove(tmpname)
+            raise
+
+def step_fingerprint(mod, activity, args, world):
+    """
+    Digest of the module, arguments and input files of a make step, and of
+    the SOURCE_DATE_EPOCH the date stamped on its outputs is taken from
+    """
+    h = hashlib.sha1(mesi_file.__version__)
+    epoch = os.environ.get('SOURCE_DATE_EPOCH', '')
+    for part in [activity, module_digest(mod), os.getcwd(), epoch] + list(args):
+        h.update('\0')
+        h.update(part)
+    if hasattr(mod, 'inputs'):
+        for path in mod.inputs(world, *args):
+            h.update('\0')
+            h.update(mesi_file.file_digest(path))
+    return h.hexdigest()
+
+def dict_digest_of(world):
+    """Return a function computing the digest of coe_dict on first call"""
+    digest = []
+    def get():
+        if not digest:
+            h = hashlib.sha1()
+            for obj in frozen_objects(world.coe_dict):
+                h.update(obj.digest)
+            digest.append(h.hexdigest())
+        return digest[0]
+    return get
+
+def run_step(world, mod, args):
+    """
+    Run make module mod on world, returning the settings it read (with
+    their values before the step), all settings before the step if it
+    iterated over them (else None), and the settings it wrote (with their
+    new values)
+    """
+    settings = world.settings
+    before = dict(settings)
+    world.settings = recording = recording_settings(settings)
+    try:
+        with mesi_trace.span('%s(%s)' % (mod.__name__, ','.join(args)), 'make',
+                file=world.filename):
+            mod.make(world, *args)
+    finally:
+        world.settings = settings
+        # Whatever the module declares, it may have changed the objects
+        world.changed()
+    reads = dict((k, before.get(k, missing)) for k in recording.read)
+    keys = frozenset(before) if recording.iterated else None
+    writes = dict((k, settings.get(k, missing)) for k in recording.written)
+    return reads, keys, writes
+
+# A resource conflicting with all others, see step_resources()
+everything = '*'
+
+def step_resources(mod, world, args):
+    """
+    Return (reads, writes): the sets of parts of world ('settings',
+    'coe_dict') and of files a make step reads and writes, as declared by
+    its module. A module which declares nothing reads and writes everything.
+    """
+    if not hasattr(mod, 'reads') or not hasattr(mod, 'outputs'):
+        return set([everything]), set([everything])
+    reads = set(mod.reads)
+    writes = set(getattr(mod, 'writes', ()))
+    if hasattr(mod, 'inputs'):
+        reads.update(os.path.realpath(f) for f in mod.inputs(world, *args))
+    writes.update(os.path.realpath(f) for f in mod.outputs(world, *args))
+    return reads, writes
+
+class make_step():
+    """A make statement of world, with its place in the step DAG"""
+    def __init__(self, world, activity, args, occurrence, number):
+        self.number = number        # position in make_list
+        self.activity = activity
+        self.args = args
+        self.key = (activity, tuple(args), occurrence)
+        self.mod = importlib.import_module(activity)
+        self.reads, self.writes = step_resources(self.mod, world, args)
+        # Steps which must run first, and the length of the longest path to
+        # this step from one without dependencies
+        self.deps = []
+        self.level = 0
+
+    def conflicts(self, other):
+        """True if the order of this step and other matters"""
+        if everything in self.reads | self.writes | other.reads | other.writes:
+            return True
+        return bool(self.writes & (other.reads | other.writes) or other.writes & self.reads)
+
+    def title(self):
+        return '%s(%s)' % (self.activity, ','.join(self.args))
+
+def plan(world):
+    """
+    Return the make_steps of world in make_list order, each depending on
+    the earlier steps it conflicts with. Steps of the same level do not
+    depend on each other.
+    """
+    steps = []
+    occurrences = {}
+    for number, (activity, args) in enumerate(world.make_list):
+        n = occurrences.get((activity, tuple(args)), 0)
+        occurrences[(activity, tuple(args))] = n + 1
+        step = make_step(world, activity, args, n, number)
+        step.deps = [s for s in steps if s.conflicts(step)]
+        step.level = max([s.level + 1 for s in step.deps] or [0])
+        steps.append(step)
+    return steps
+
+# The world of the worker processes of a make pool
+_pool_world = None
+
+def _init_pool_worker(world):
+    global _pool_world
+    _pool_world = world
+    mesi_trace.clear()
+
+def _run_pooled(job):
+    activity, args, filename, title, profile = job
+    outcome, timing = mesi_timing.measure(filename, title, profile,
+        run_step, _pool_world, importlib.import_module(activity), args)
+    return outcome, timing, mesi_trace.take()
+
+def step_profile(step, filename, profile):
+    """Where to write the cProfile statistics of step, None if not profiled"""
+    if not profile:
+        return None
+    return mesi_timing.profile_path(filename, step.activity, step.number)
+
+def run_level(world, steps, jobs, filename, profile=False):
+    """
+    Run steps, which do not depend on each other, returning the result of
+    run_step for each with its phase_timing (see mesi_timing), profiling
+    them if profile. Steps which change coe_dict run in this process, the
+    others in up to jobs worker processes, forked with a copy of world.
+    Modules may define prepare(world, *args) to compute, before the fork,
+    what their steps share. The steps are CPU bound, so there are no more
+    workers than processors.
+    """
+    results = {}
+    pooled = [s for s in steps if 'coe_dict' not in s.writes]
+    workers = min(jobs, len(pooled), multiprocessing.cpu_count())
+    if workers > 1:
+        for step in pooled:
+            print 'Make %s:' % step.title()
+            if hasattr(step.mod, 'prepare'):
+                with mesi_trace.span('prepare', 'make', step=step.title()):
+                    step.mod.prepare(world, *step.args)
+        # Children would write out what is buffered again
+        sys.stdout.flush()
+        pool = multiprocessing.Pool(workers, _init_pool_worker, (world,))
+        try:
+            outcomes = pool.map(_run_pooled, [(s.activity, s.args, filename, s.title(),
+                step_profile(s, filename, profile)) for s in pooled])
+        finally:
+            pool.close()
+            pool.join()
+        for step, ((reads, keys, writes), timing, events) in zip(pooled, outcomes):
+            mesi_trace.add(events)
+            # Apply what the step changed in its copy of world
+            for k, v in writes.iteritems():
+                if v is missing:
+                    world.settings.pop(k, None)
+                else:
+                    world.settings[k] = v
+            results[step.key] = ((reads, keys, writes), timing)
+    for step in steps:
+        if step.key not in results:
+            print 'Make %s:' % step.title()
+            results[step.key] = mesi_timing.measure(filename, step.title(),
+                step_profile(step, filename, profile), run_step, world, step.mod, step.args)
+    return [results[step.key] for step in steps]
+
+def make(world, filename, state_path=None, force=False, jobs=1, timings=None, profile=False):
+    """
+    Run the make statements of world, parsed from filename, skipping the
+    steps which are up to date (all of them run if force). With jobs > 1,
+    steps which do not depend on each other run in parallel. The
+    phase_timing of each step is appended to the list timings, if given.
+    If profile, the cProfile statistics of each step which runs are
+    written next to filename (see mesi_timing.profile_path).
+    """
+    state = build_state(filename, state_path)
+    if not force:
+        state.load()
+    records = {}
+    measured = []               # (step number, phase_timing)
+    dict_digest = dict_digest_of(world)
+    steps = plan(world)
+    try:
+        for level in xrange(max([s.level + 1 for s in steps] or [0])):
+            pending = []
+            for step in (s for s in steps if s.level == level):
+                fingerprint = step_fingerprint(step.mod, step.activity, step.args, world)
+                rec = state.records.get(step.key)
+                if rec is not None and rec.valid(world, fingerprint, dict_digest):
+                    print 'Make %s: up to date' % step.title()
+                    _, timing = mesi_timing.measure(filename, step.title(), None, rec.replay, world)
+                    measured.append((step.number, timing._replace(up_to_date=True)))
+                    records[step.key] = rec
+                    continue
+                # A step which fails leaves no record
+                state.records.pop(step.key, None)
+                pending.append((step, fingerprint))
+
+            outcomes = run_level(world, [step for step, fingerprint in pending], jobs, filename, profile)
+            for (step, fingerprint), ((reads, keys, writes), timing) in zip(pending, outcomes):
+                measured.append((step.number, timing))
+                if not hasattr(step.mod, 'outputs'):
+                    continue
+                rec = step_record(fingerprint,
+                    dict_digest() if 'coe_dict' in getattr(step.mod, 'reads', ('coe_dict',)) else None,
+                    step.mod.outputs(world, *step.args))
+                rec.reads, rec.keys, rec.writes = reads, keys, writes
+                records[step.key] = rec
+    finally:
+        # Steps not reached keep their records from the previous build
+        for key, rec in state.records.iteritems():
+            records.setdefault(key, rec)
+        state.records = records
+        state.save()
+        if timings is not None:
+            timings.extend(timing for number, timing in sorted(measured))
@@ -0,0 +1,164 @@
+# -*- coding: utf-8 -*-
+"""
+mesi_cache.py
+
+On-disk cache of parsed .mesi files. A parse result (the result_object
+with its coe_dict, make_list and settings) is pickled under a key derived
+from the source text and the mesicat version, so an unchanged .mesi file
+is never parsed twice.
+
+Created on Fri Oct 16 2026
+
+@copyright MIT License
+Copyright (C) 2013 Dynamic Systems Inc.
+Permission is hereby granted, free of charge, to any person obtaining 
+a copy of this software and associated documentation files (the 
+"Software"), to deal in the Software without restriction, including 
+without limitation the rights to use, copy, modify, merge, publish, 
+distribute, sublicense, and/or sell copies of the Software, and to 
+permit persons to whom the Software is furnished to do so, subject to 
+the following conditions:
+The above copyright notice and this permission notice shall be included 
+in all copies or substantial portions of the Software.
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS 
+OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, 
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL 
+THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR 
+OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, 
+ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR 
+OTHER DEALINGS IN THE SOFTWARE.
+"""
+
+import os
+import time
+import errno
+import hashlib
+import tempfile
+import cPickle as pickle
+import mesi_file
+import mesi_trace
+
+default_cache_dir = os.path.join(os.path.expanduser('~'), '.cache', 'mesicat')
+
+class parse_cache():
+    """
+    A directory of pickled parse results. Entries not used for max_age
+    seconds are removed, and the least recently used entries are removed
+    while the directory holds more than max_bytes.
+    """
+    suffix = '.pickle'
+
+    def __init__(self, path=None, max_bytes=64*1024*1024, max_age=30*24*3600):
+        self.path = path or default_cache_dir
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+
+    def key(self, string, filename=None):
+        # Include statements are relative to the file's directory
+        h = hashlib.sha1(mesi_file.__version__)
+        h.update('\0')
+        h.update(os.path.realpath(os.path.dirname(filename or '.')))
+        h.update('\0')
+        h.update(string)
+        return h.hexdigest()
+
+    def entry(self, key):
+        return os.path.join(self.path, key + self.suffix)
+
+    def load(self, string, filename=None):
+        """Return the cached result_object for string, or None"""
+        fname = self.entry(self.key(string, filename))
+        try:
+            with mesi_trace.span('cache load', 'io', path=fname):
+                with open(fname, 'rb') as infile:
+                    world = pickle.load(infile)
+        except IOError:
+            return None
+        except Exception:
+            # Truncated or stale entry: drop it and parse again
+            self.remove(fname)
+            return None
+        # The entry is only valid while the included files are unchanged
+        for path, digest in world.includes:
+            try:
+                if mesi_file.file_digest(path) != digest:
+                    return None
+            except IOError:
+                return None
+        # Record the use for LRU eviction
+        try:
+            os.utime(fname, None)
+        except OSError:
+            pass
+        return world
+
+    def store(self, string, world, filename=None):
+        """Save world as the parse result of string"""
+        try:
+            os.makedirs(self.path)
+        except OSError, err:
+            if err.errno != errno.EEXIST:
+                raise
+        # Write to a temporary file and rename, so concurrent runs never
+        # see a partial entry
+        fd, tmpname = tempfile.mkstemp(suffix='.tmp', dir=self.path)
+        try:
+            with mesi_trace.span('cache store', 'io', path=tmpname):
+                with os.fdopen(fd, 'wb') as out:
+                    pickle.dump(world, out, pickle.HIGHEST_PROTOCOL)
+            os.rename(tmpname, self.entry(self.key(string, filename)))
+        except:
+            self.remove(tmpname)
+            raise
+        self.evict()
+
+    def remove(self, fname):
+        try:
+            os.remove(fname)
+        except OSError:
+            pass
+
+    def evict(self):
+        """Apply the age and size limits"""
+        entries = []
+        now = time.time()
+        try:
+            names = os.listdir(self.path)
+        except OSError:
+            return
+        for name in names:
+            if not name.endswith(self.suffix):
+                continue
+            fname = os.path.join(self.path, name)
+            try:
+                st = os.stat(fname)
+            except OSError:
+                continue
+            if now - st.st_mtime > self.max_age:
+                self.remove(fname)
+            else:
+                entries.append((st.st_mtime, st.st_size, fname))
+
+        total = sum(e[1] for e in entries)
+        for mtime, size, fname in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            self.remove(fname)
+            total -= size
+
+    def clear(self):
+        """Remove all entries"""
+        max_age, self.max_age = self.max_age, -1
+        try:
+            self.evict()
+        finally:
+            self.max_age = max_age
+
+    def parse(self, string, **kwargs):
+        """mesi_file.parse(string, **kwargs), answered from the cache if possible"""
+        filename = kwargs.get('filename')
+        world = self.load(string, filename)
+        if world is None:
+            world = mesi_file.parse(string, **kwargs)
+            self.store(string, world, filename)
+        return world
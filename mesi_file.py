@@ -30,9 +30,19 @@ OTHER DEALINGS IN THE SOFTWARE.
 import itertools
 import re
 import fnmatch
+import bisect
+import os
+import hashlib
+import threading
+import cStringIO
+import mesi_trace
 from pyparsing import *
 from coe_defs import *
 
+# mesicat version. Part of the parse cache key (see mesi_cache.py), so bump
+# it whenever the parse result changes for the same source.
+__version__ = '0.7'
+
 """
 
 ------------------------------------------------------------------------------
@@ -42,6 +52,8 @@ mesi file outline:
 
 make <module_name> [<arugments> ...];
 
+include "<file name>";
+
 record [<access>] <symbol> [@<index>] ["<description>"] {
     [<basic_type> [<access>] symbol [@<subindex>] [=<default_value>] ["<description>"];]
     ...
@@ -55,6 +67,7 @@ record [<access>] <symbol> [@<index>] ["<description>"] {
 
 Grammar:
 
+include_statement = 'include' '"' string '"' ';'
 record_statement = 'record' access_specifier symbol (index_specifier|description_specifier)* '{' subindex_list '}' ';'
 map_statement = 'map' access_specifier symbol (index_specifier|description_specifier)* '{' symbol_list '}' ';'
 value_statement = basic_type access_specifier symbol (index_specifier|description_specifier)* default_specifier ';'
@@ -88,8 +101,19 @@ If description is omitted, it will default to "Index 0x%04X" or "SubIndex %03d"
 <symbol> returns the default value for the symbol. 
 &<symbol> returns the CoE index,subindex,size code (as uint32_t)
 $<symbol> returns the CoE index (as uint16_t)
+Default values, property values and assigned values may refer to symbols
+defined further down the file. Such references are resolved after the
+whole file is evaluated; circular references are an error. Indexes, array
+sizes and wildcard patterns are evaluated where they appear.
 If the default specifier list for an array declaration is larger than the
 defined size of the array, the process will fail with an error.
+
+An included file is a self-contained unit: it is evaluated on its own, then
+its symbols, objects and make statements are merged into the including file
+at the point of the include. It cannot refer to symbols of the including
+file, and does not change the index following an object without @<index>.
+The file name is relative to the directory of the including file. Each
+file is parsed only once per process.
 """
 
 LPAR,RPAR,LBRACK,RBRACK,LBRACE,RBRACE,SEMI,COMMA,EQUAL = map(Suppress, "()[]{};,=")
@@ -115,388 +139,922 @@ access_bits = {
     'safe_parameter':0x1000
 }
 
-def parse(string):
-    coe_vars = {}
-    
-    # make keywords for CoE basic types
-    type_keywords = []
-    for ct in coe_types.keys():
-        kw = Keyword(ct).setName(ct)
-        vars()[ct] = kw
-        type_keywords.append(kw)
-        
-    access_keywords = []
-    for k,v in access_bits.iteritems():
-        kw = Keyword(k) #.setName(k.upper())
-        vars()[k.upper()] = kw
-        access_keywords.append(kw)
-    
-    TYPE = MatchFirst(type_keywords)
-    
-    ACCESS = Group( ZeroOrMore( MatchFirst(access_keywords) ) )
-    def eval_access(tok):
-        field = 0
-        for t in tok[0]:
-            bits = access_bits[t]
-            if bits >= 0:
-                field |= bits
-        #return {'mask':mask,'field':field}
-        return field
-    ACCESS.setParseAction(eval_access)
-    
-    RECORD = Keyword("record")
-    
-    NAME = Word(alphas+"_", alphanums+"_.")
-    WILDNAME = Word(alphas+"_", alphanums+"_.*")
-    integer = Regex(r"[+-]?\d+").setParseAction(lambda tok: int(tok[0]))
-    real_value = Regex(r"[+-]?\d+\.\d+([eE][+-]?[0-9]+)?").setParseAction(lambda tok: float(tok[0]))
-    hex_integer = Regex(r"0x[0-9a-zA-Z]+").setParseAction(lambda tok: int(tok[0],16))
-    
-    def find_wildname_list(symbol):
-        pat = re.compile(fnmatch.translate(symbol))
-        lst = [coe_vars[k] for k in coe_vars.keys() if pat.match(k)]
-        #print 'find_wildname_list(',symbol,') => ',lst
-        return lst
-    
-    expr = MatchFirst([hex_integer, real_value, integer, "&" + NAME, "$" + NAME, NAME, dblQuotedString])
-    class expr_eval():
-        def __init__(self, tok):
-            self.values = tok
-        def eval(self, parent):
-            t = self.values
-            
-            if isinstance(t[0],int) or isinstance(t[0],float):
-                return t[0]
-                
-            if t[0][0]=='"':
-                return t[0][1:-1]
-            elif t[0]=='$':
-                f = lambda x: x.index
-                t = t[1:]
-            elif t[0]=='&':
-                f = lambda x: x.coe_reference()
-                t = t[1:]
-            else:
-                f = lambda x: x.default
-            return f( coe_vars[t] )
-    expr.setParseAction(expr_eval)
-    expr = Group( expr )
-    
-    list_expr = delimitedList(MatchFirst([hex_integer, integer, Combine("&" + WILDNAME), Combine("$" + WILDNAME), WILDNAME]))
-    class list_expr_eval():
-        def __init__(self, tok):
-            self.values = tok
-        def eval(self, parent):
-            vals = []
-            #print 'processing',self.values
-            for t in self.values:
-                if isinstance(t,int) or isinstance(t,float):
-                    vals.append(t)
-                    continue
-
-                if t[0]=='$':
-                    f = lambda x: x.index
-                    t = t[1:]
-                elif t[0]=='&':
-                    f = lambda x: x.coe_reference()
-                    t = t[1:]
-                else:
-                    f = lambda x: x.default
-                vals += sorted(f(x) for x in find_wildname_list(t))
-            return vals
-    list_expr.setParseAction(list_expr_eval)
-    list_expr = Group( list_expr )
-    
-    INDEX = Suppress('@') + expr("index")
-    DESCRIPTION = Suppress(':') + (dblQuotedString.copy().setParseAction(removeQuotes))("description")
-    STRING_LITERAL = dblQuotedString.copy().setParseAction(removeQuotes)
-    DEFAULT = EQUAL + expr("default")
-    PROPERTY = ZeroOrMore(Group(Suppress('.') + NAME("key") + EQUAL + expr("value")))("property")
-    
-    #expr.setDebug()
-    #map_expr.setDebug()
-    #INDEX.setDebug()
-    #DESCRIPTION.setDebug()
-    
-    class make_object():
-        """Simple object to hold a make statement"""
-        def __init__(self, symbol, value):
-            # The name default is used so this can be read like a coe_sub_object
-            self.index = 0
-            self.symbol = symbol
-            self.default = value
-        def __repr__(self):
-            return "make_object(symbol='%s', default='%s')" % (self.symbol, self.default)
-    
-    MAKE_ARGS = ZeroOrMore( Word(alphanums+":!@#$%^()=+[]{}<>_./\\-") )
-    make_stmt = 'make' + NAME('module') + MAKE_ARGS('args') + SEMI;
-    class eval_make():
-        def __init__(self, tok):
-            self.values = tok
-        def eval(self,parent):
-            statement_parms = self.values.asDict()
-           
-            parent.make_list.append( 
-                (statement_parms['module'], 
-                 statement_parms['args'].asList() if 'args' in statement_parms else [])
-            )
-
-            return None
-    make_stmt.setParseAction(eval_make)
-
-    class assign_object():
-        """Simple object to hold an assigned value"""
-        def __init__(self, symbol, value):
-            # The name default is used so this can be read like a coe_sub_object
-            self.index = 0
-            self.symbol = symbol
-            self.default = value
-        def __repr__(self):
-            return "assign_object(symbol='%s', default='%s')" % (self.symbol, self.default)
-        def coe_reference(self):
-            raise TypeError("Error: assign_object %s cannot be referenced" % self.symbol)
-    def add_coe_literal(symbol, value):    
-        obj = assign_object(symbol, value)
-        coe_vars[symbol] = obj
-        
-    assign_stmt = NAME('symbol') + '=' + expr('default') + SEMI
-    class eval_assign():
-        def __init__(self, tok):
-            self.values = tok
-        def eval(self,parent):
-            statement_parms = self.values.asDict()
-
-            symbol = statement_parms['symbol']
-
-            default = statement_parms['default']
-            if not isinstance(default, basestring):
-                default = default[0].eval(self)
-            
-            add_coe_literal(symbol, default)
-
-            return None
-    assign_stmt.setParseAction(eval_assign)    
-    
-    variable_statement = TYPE("btype") + ACCESS("access") + NAME("symbol") + ZeroOrMore(INDEX | DEFAULT | DESCRIPTION) + PROPERTY + SEMI;
-    subindex_statement = variable_statement.copy()
-    class eval_variable():
-        def __init__(self, tok):
-            self.values = tok
-            self.parameters = { 'default':0, 'index':0, 'description':None }            
-        def eval(self,parent):
-            # parent is object with .last_index
-            statement_parms = self.values.asDict()
-
-            if 'index' in statement_parms:
-                index = statement_parms['index'][0].eval(self)
-            else:
-                index = parent.last_index+1
-            parent.last_index = index
-            access = statement_parms.get('access',0)
-            btype = statement_parms['btype']
-            symbol = statement_parms['symbol']
-            if 'default' in statement_parms:
-                default = statement_parms['default'][0].eval(self)
-            else:
-                default = 0
-            description = statement_parms.get('description', 'Index %#04x'%index) 
-
-            obj = coe_object(coe_object.oc_variable, index, symbol, description)
-            obj.default = default
-            
-            obj.add(default,access=access,index=index,subindex=0,btype=btype,symbol=symbol,description=description)
-            coe_vars[symbol] = obj
-
-            obj.properties = {}            
-            if 'property' in statement_parms:
-                for prop in statement_parms['property']:
-                    key = prop['key']
-                    value = prop['value'][0].eval(self)
-                    obj.properties[key] = value
-                    add_coe_literal('.'.join((symbol,key)), value)
-
-            return obj
-    variable_statement.setParseAction(eval_variable)    
-
-    class eval_subindex():
-        def __init__(self, tok):
-            self.values = tok
-        def eval(self,parent):
-            # parent is coe_object
-            statement_parms = self.values.asDict()
-
-            index = parent.index
-            if 'index' in statement_parms:
-                subindex = statement_parms['index'][0].eval(self)
-            else:
-                subindex = parent.max_subindex()+1
-            access = statement_parms.get('access',0) | parent.default_access
-            btype = statement_parms['btype']
-            symbol = statement_parms['symbol']
-            if 'default' in statement_parms:
-                default = statement_parms['default'][0].eval(self)
-            else:
-                default = 0
-            description = statement_parms.get('description') 
-
-            so = coe_sub_object(index, subindex, access, btype, symbol, default, description)
-            coe_vars[parent.symbol+'.'+symbol] = so
-            return so
-    subindex_statement.setParseAction(eval_subindex)    
-    
-    MERGE = delimitedList(Group(OneOrMore(INDEX | DESCRIPTION)))("merge")
-    #MERGE.setDebug()
-    
-    record_statement = RECORD + ACCESS("access") + NAME("symbol") + ((LPAR + MERGE + RPAR) | ZeroOrMore(INDEX | DESCRIPTION)) + PROPERTY + Group(LBRACE + OneOrMore(subindex_statement) + RBRACE)("subindex") + SEMI
-    class eval_record():
-        def __init__(self, tok):
-            self.values = tok
-            self.default_access = 0
-            
-        def make_obj(self, symbol, parms, spec):
-            if 'index' in spec:
-                index = spec['index'][0].eval(self)
-            else:
-                index = self.parent.last_index+1
-            self.parent.last_index = index
-            
-            description = spec.get('description', 'Index %#04x'%index) 
-
-            obj = coe_object(coe_object.oc_record, index, symbol, description)
-            obj.default_access = self.default_access
-            obj.properties = self.properties
-            for key,value in self.properties.iteritems():
-                add_coe_literal('.'.join((symbol,key)), value)
-            
-            coe_vars[symbol] = obj
-            # Add nothing -- gets us a subindex 0 and padding
-            obj.add()
-        
-            for sis in parms['subindex']:
-                obj.subs.append( sis.eval(obj) )
-            obj.subs[0].default = obj.max_subindex()
-            
-            return obj
-            
-        def eval(self,parent):
-            self.parent = parent
-            # parent is some object with .last_index
-            statement_parms = self.values.asDict()
-            
-            self.default_access = statement_parms.get('access',0)
-
-            base_symbol = statement_parms['symbol']
-
-            self.properties = {}            
-            if 'property' in statement_parms:
-                for prop in statement_parms['property']:
-                    key = prop['key']
-                    value = prop['value'][0].eval(self)
-                    self.properties[key] = value
-
-            if 'merge' in statement_parms:
-                objs = []     
-                merge_len = len(statement_parms['merge'])
-                for i in xrange(merge_len):
-                    spec = statement_parms['merge'][i].asDict()
-                    symbol = '%s_%d' % (base_symbol, i)
-                    obj = self.make_obj(symbol, statement_parms, spec)
-                    obj.merge = merge_specification(objs, base_symbol, merge_len, i)
-                    objs.append(obj)
-                return objs
-            else:
-                return self.make_obj(base_symbol, statement_parms, statement_parms)
-                
-    record_statement.setParseAction(eval_record)    
-
-    array_statement = TYPE("btype") + ACCESS("access") + NAME("symbol") + LBRACK + Optional(expr("size")) + RBRACK + ZeroOrMore(INDEX | DESCRIPTION) + PROPERTY + Optional(EQUAL + LBRACE + list_expr("values") + RBRACE) + SEMI
-    class eval_array():
-        def __init__(self, tok):
-            self.values = tok
-            self.parameters = {}
-        def eval(self,parent):
-            # parent is some object with .last_index
-            statement_parms = self.values.asDict()
-            
-            btype = statement_parms['btype']
-            access = statement_parms.get('access',0)
-            if 'index' in statement_parms:
-                index = statement_parms['index'][0].eval(self)
+
+def access_field(names):
+    """Combine access keywords into an access code"""
+    field = 0
+    for t in names:
+        bits = access_bits[t]
+        if bits >= 0:
+            field |= bits
+    #return {'mask':mask,'field':field}
+    return field
+
+def eval_access(tok):
+    return access_field(tok[0])
+
+class symbol_table(dict):
+    """
+    The coe_vars dictionary: symbol -> object. Alongside the dictionary, a
+    sorted list of the symbols is kept, so that wildcard patterns can be
+    answered by scanning only the symbols sharing the pattern's literal
+    prefix.
+
+    If journal is a list, every assignment is also appended to it as a
+    (symbol, object) pair.
+    """
+    def __init__(self, *args, **kwargs):
+        dict.__init__(self, *args, **kwargs)
+        self.sorted_keys = sorted(self.keys())
+        self.journal = None
+
+    def __setitem__(self, key, value):
+        if key not in self:
+            bisect.insort(self.sorted_keys, key)
+        dict.__setitem__(self, key, value)
+        if self.journal is not None:
+            self.journal.append((key, value))
+
+    def __delitem__(self, key):
+        dict.__delitem__(self, key)
+        del self.sorted_keys[bisect.bisect_left(self.sorted_keys, key)]
+
+    def update(self, other):
+        """Merge the symbols of the dict other"""
+        new_keys = [k for k in other if k not in self]
+        dict.update(self, other)
+        if new_keys:
+            # merging two sorted runs is linear for sort()
+            new_keys.sort()
+            self.sorted_keys += new_keys
+            self.sorted_keys.sort()
+        if self.journal is not None:
+            self.journal.extend(other.iteritems())
+
+    def __reduce__(self):
+        # Rebuild through __init__, which sets up sorted_keys
+        return (symbol_table, (dict(self),))
+
+    def prefix_range(self, prefix):
+        """Return the sorted symbols starting with prefix"""
+        keys = self.sorted_keys
+        lo = bisect.bisect_left(keys, prefix)
+        hi = bisect.bisect_left(keys, prefix + '\xff', lo)
+        return keys[lo:hi]
+
+# compiled fnmatch patterns by glob: (literal prefix, regex or None for
+# a plain prefix* glob)
+_wild_patterns = {}
+_wild_chars = re.compile(r'[*?[]')
+
+def wild_pattern(symbol):
+    pat = _wild_patterns.get(symbol)
+    if pat is None:
+        m = _wild_chars.search(symbol)
+        prefix = symbol[:m.start()] if m else symbol
+        if symbol == prefix + '*':
+            pat = (prefix, None)
+        else:
+            pat = (prefix, re.compile(fnmatch.translate(symbol)))
+        _wild_patterns[symbol] = pat
+    return pat
+
+def find_wildname_list(world, symbol):
+    coe_vars = world.coe_vars
+    if _wild_chars.search(symbol) is None:
+        return [coe_vars[symbol]] if symbol in coe_vars else []
+    prefix, pat = wild_pattern(symbol)
+    keys = coe_vars.prefix_range(prefix)
+    if pat is not None:
+        keys = [k for k in keys if pat.match(k)]
+    lst = [coe_vars[k] for k in keys]
+    #print 'find_wildname_list(',symbol,') => ',lst
+    return lst
+
+def reference_value(mode, obj):
+    """Value of a reference to obj: $sym, &sym or plain sym (mode '')"""
+    if mode == '$':
+        return obj.index
+    elif mode == '&':
+        return obj.coe_reference()
+    return obj.default
+
+def resolve_reference(world, kind, mode, symbol):
+    """
+    Resolve a symbol reference against world. kind 'sym' is a single
+    symbol, 'glob' a wildcard pattern from a list expression, which
+    resolves to the sorted list of values of all matching symbols.
+    kind 'include' is a reference to an included file, its value the digest
+    of the file contents.
+    """
+    if kind == 'include':
+        return file_digest(symbol)
+    if kind == 'glob':
+        return sorted(reference_value(mode, x) for x in find_wildname_list(world, symbol))
+    return reference_value(mode, world.coe_vars[symbol])
+
+def read_reference(world, kind, mode, symbol):
+    """resolve_reference(), recording the read if world.reads is a list"""
+    value = resolve_reference(world, kind, mode, symbol)
+    if world.reads is not None:
+        world.reads.append((kind, mode, symbol, value))
+    return value
+
+class deferred_reference():
+    """
+    A reference to a symbol which is not defined yet where it appears. It
+    stands in for the value until resolve_deferred() replaces it, once the
+    whole body is evaluated.
+    """
+    def __init__(self, mode, symbol):
+        self.mode = mode
+        self.symbol = symbol
+        self.value = None
+        self.resolved = False
+        self.resolving = False
+    def __repr__(self):
+        return "deferred_reference('%s%s')" % (self.mode, self.symbol)
+
+    def resolve(self, world):
+        """Return the value of the reference, following chains of them"""
+        chain = []
+        ref = self
+        try:
+            while isinstance(ref, deferred_reference) and not ref.resolved:
+                if ref.resolving:
+                    raise ValueError("Error: circular reference to %s" %
+                        ' -> '.join(r.symbol for r in chain + [ref]))
+                ref.resolving = True
+                chain.append(ref)
+                if ref.symbol not in world.coe_vars:
+                    raise ValueError("Error: undefined symbol %s" % ref.symbol)
+                ref = reference_value(ref.mode, world.coe_vars[ref.symbol])
+        finally:
+            for r in chain:
+                r.resolving = False
+        value = ref.value if isinstance(ref, deferred_reference) else ref
+        for r in chain:
+            r.value = value
+            r.resolved = True
+        return value
+
+def defer_reference(world, mode, symbol):
+    """Return a deferred_reference to symbol, to be resolved by world"""
+    ref = deferred_reference(mode, symbol)
+    world.deferred.append(ref)
+    if world.reads is not None:
+        # Never equal to a value resolved later on, so the reading
+        # statement is always evaluated again
+        world.reads.append(('sym', mode, symbol, ref))
+    return ref
+
+def resolve_deferred(world):
+    """
+    Replace the deferred_references left in the defaults and properties of
+    the objects and symbols of world by their values. Raises ValueError on
+    undefined symbols and circular references.
+    """
+    if not world.deferred:
+        return
+    def value(v):
+        if isinstance(v, deferred_reference):
+            return v.resolve(world)
+        return v
+    for obj in itertools.chain(world.coe_dict, world.coe_vars.itervalues()):
+        if hasattr(obj, 'default'):
+            obj.default = value(obj.default)
+        properties = getattr(obj, 'properties', None)
+        if properties:
+            for key in properties:
+                properties[key] = value(properties[key])
+        for so in getattr(obj, 'subs', ()):
+            so.default = value(so.default)
+    world.deferred = []
+
+class expr_eval():
+    def __init__(self, tok):
+        self.values = tok
+    def eval(self, world, defer=False):
+        """
+        Evaluate the expression. If defer is True, a reference to a symbol
+        not defined yet evaluates to a deferred_reference.
+        """
+        t = self.values
+
+        if isinstance(t[0], (int, long, float)):
+            return t[0]
+
+        if t[0][0]=='"':
+            return t[0][1:-1]
+        elif t[0]=='$' or t[0]=='&':
+            mode, symbol = t[0], t[1]
+        else:
+            mode, symbol = '', t[0]
+        if defer and (symbol not in world.coe_vars or isinstance(
+                reference_value(mode, world.coe_vars[symbol]), deferred_reference)):
+            # Refer to the symbol itself rather than copy its pending
+            # reference, so that a circular reference reports every symbol
+            return defer_reference(world, mode, symbol)
+        return read_reference(world, 'sym', mode, symbol)
+
+class list_expr_eval():
+    def __init__(self, tok):
+        self.values = tok
+    def eval(self, world, defer=False):
+        """
+        Evaluate to a list of values. If defer is True, a plain (not
+        wildcard) symbol not defined yet evaluates to a deferred_reference.
+        """
+        vals = []
+        #print 'processing',self.values
+        for t in self.values:
+            if isinstance(t, (int, long, float)):
+                vals.append(t)
+                continue
+
+            if t[0]=='$' or t[0]=='&':
+                mode, symbol = t[0], t[1:]
             else:
-                index = parent.last_index+1
-            parent.last_index = index
-            symbol = statement_parms['symbol']
-            if 'size' in statement_parms:
-                size = statement_parms['size'][0].eval(self)
+                mode, symbol = '', t
+            if defer and symbol not in world.coe_vars and not _wild_chars.search(symbol):
+                vals.append(defer_reference(world, mode, symbol))
             else:
-                size = 0
-            description = statement_parms.get('description', 'Index %#04x'%index) 
-
-            obj = coe_object(coe_object.oc_array, index, symbol, description)
-            obj.default_access = statement_parms.get('access',0)
-            coe_vars[symbol] = obj
-            
-            default_values = []
+                vals += read_reference(world, 'glob', mode, symbol)
+        return vals
+
+def file_digest(path):
+    with open(path, 'rb') as infile:
+        return hashlib.sha1(infile.read()).hexdigest()
+
+class compiled_unit():
+    """
+    The result of evaluating an included file on its own: its symbols,
+    objects, make statements and settings, ready to be merged into the
+    result of any file including it. includes lists (path, digest) of the
+    file and all files it includes in turn, stamps their (path, (mtime,
+    size)) when the unit was compiled. The objects of a unit are shared by
+    all results including it.
+    """
+    def __init__(self, path, stamp, digest, world, stamps):
+        self.path = path
+        self.digest = digest
+        self.symbols = dict(world.coe_vars)
+        self.objs = world.coe_dict
+        self.makes = world.make_list
+        self.settings = world.settings
+        self.includes = world.includes + [(path, digest)]
+        self.stamps = stamps + [(path, stamp)]
+
+    def valid(self):
+        """True if none of the files making up the unit changed"""
+        try:
+            return all(file_stamp(path) == stamp for path, stamp in self.stamps)
+        except OSError:
+            return False
+
+    def merge(self, world):
+        world.coe_vars.update(self.symbols)
+        world.coe_dict.extend(self.objs)
+        world.make_list.extend(self.makes)
+        world.includes.extend(self.includes)
+
+def file_stamp(path):
+    st = os.stat(path)
+    return (st.st_mtime, st.st_size)
+
+# Included files by real path
+_units = {}
+
+def load_unit(path, world):
+    """
+    Return the compiled_unit for the file path, parsing the file unless it
+    was parsed before and has not changed since.
+    """
+    path = os.path.realpath(path)
+    if path in world.include_stack:
+        raise ValueError("Error: %s includes itself" % path)
+    unit = _units.get(path)
+    if unit is None or not unit.valid():
+        stamp = file_stamp(path)
+        with mesi_trace.span('read', 'io', path=path):
+            with open(path, 'r') as infile:
+                source = infile.read()
+        unit_world = result_object(path, **world.parse_options)
+        unit_world.include_stack = world.include_stack + (path,)
+        unit_world.unit_stamps = []
+        parse_body(source, **world.parse_options).eval(unit_world)
+        unit_world.update_settings()
+        unit = compiled_unit(path, stamp, hashlib.sha1(source).hexdigest(),
+                             unit_world, unit_world.unit_stamps)
+        _units[path] = unit
+    if world.unit_stamps is not None:
+        world.unit_stamps += unit.stamps
+    return unit
+
+class eval_include():
+    def __init__(self, parms):
+        self.parms = parms
+    def eval(self, world):
+        filename = self.parms['filename']
+        if world.filename:
+            filename = os.path.join(os.path.dirname(world.filename), filename)
+        unit = load_unit(filename, world)
+        if world.reads is not None:
+            world.reads += [('include', '', path, digest) for path, digest in unit.includes]
+        unit.merge(world)
+        return None
+
+class make_object():
+    """Simple object to hold a make statement"""
+    def __init__(self, symbol, value):
+        # The name default is used so this can be read like a coe_sub_object
+        self.index = 0
+        self.symbol = symbol
+        self.default = value
+    def __repr__(self):
+        return "make_object(symbol='%s', default='%s')" % (self.symbol, self.default)
+
+class eval_make():
+    def __init__(self, parms):
+        self.parms = parms
+    def eval(self, world):
+        statement_parms = self.parms
+
+        world.make_list.append(
+            (statement_parms['module'],
+             statement_parms.get('args', []))
+        )
+
+        return None
+
+class assign_object():
+    """Simple object to hold an assigned value"""
+    def __init__(self, symbol, value):
+        # The name default is used so this can be read like a coe_sub_object
+        self.index = 0
+        self.symbol = symbol
+        self.default = value
+    def __repr__(self):
+        return "assign_object(symbol='%s', default='%s')" % (self.symbol, self.default)
+    def coe_reference(self):
+        raise TypeError("Error: assign_object %s cannot be referenced" % self.symbol)
+
+def add_coe_literal(world, symbol, value):
+    obj = assign_object(symbol, value)
+    world.coe_vars[symbol] = obj
+
+class eval_assign():
+    def __init__(self, parms):
+        self.parms = parms
+    def eval(self, world):
+        statement_parms = self.parms
+
+        symbol = statement_parms['symbol']
+
+        default = statement_parms['default'].eval(world, defer=True)
+
+        add_coe_literal(world, symbol, default)
+
+        return None
+
+class eval_variable():
+    def __init__(self, parms):
+        self.parms = parms
+    def eval(self, world):
+        # world is object with .last_index
+        statement_parms = self.parms
+
+        if 'index' in statement_parms:
+            index = statement_parms['index'].eval(world)
+        else:
+            index = world.last_index+1
+        world.last_index = index
+        access = statement_parms.get('access',0)
+        btype = statement_parms['btype']
+        symbol = statement_parms['symbol']
+        if 'default' in statement_parms:
+            default = statement_parms['default'].eval(world, defer=True)
+        else:
+            default = 0
+        description = statement_parms.get('description', 'Index %#04x'%index)
+
+        obj = coe_object(coe_object.oc_variable, index, symbol, description)
+        obj.default = default
+
+        obj.add(default,access=access,index=index,subindex=0,btype=btype,symbol=symbol,description=description)
+        world.coe_vars[symbol] = obj
+
+        obj.properties = {}
+        if 'property' in statement_parms:
+            for key,value in statement_parms['property']:
+                value = value.eval(world, defer=True)
+                obj.properties[key] = value
+                add_coe_literal(world, '.'.join((symbol,key)), value)
+
+        return obj
+
+class eval_subindex():
+    def __init__(self, parms):
+        self.parms = parms
+    def eval(self, world, parent):
+        # parent is coe_object
+        statement_parms = self.parms
+
+        index = parent.index
+        if 'index' in statement_parms:
+            subindex = statement_parms['index'].eval(world)
+        else:
+            subindex = parent.max_subindex()+1
+        access = statement_parms.get('access',0) | parent.default_access
+        btype = statement_parms['btype']
+        symbol = statement_parms['symbol']
+        if 'default' in statement_parms:
+            default = statement_parms['default'].eval(world, defer=True)
+        else:
+            default = 0
+        description = statement_parms.get('description')
+
+        so = coe_sub_object(index, subindex, access, btype, symbol, default, description)
+        world.coe_vars[parent.symbol+'.'+symbol] = so
+        return so
+
+class eval_record():
+    def __init__(self, parms):
+        self.parms = parms
+        self.default_access = 0
+
+    def make_obj(self, world, symbol, parms, spec):
+        if 'index' in spec:
+            index = spec['index'].eval(world)
+        else:
+            index = world.last_index+1
+        world.last_index = index
+
+        description = spec.get('description', 'Index %#04x'%index)
+
+        obj = coe_object(coe_object.oc_record, index, symbol, description)
+        obj.default_access = self.default_access
+        obj.properties = self.properties
+        for key,value in self.properties.iteritems():
+            add_coe_literal(world, '.'.join((symbol,key)), value)
+
+        world.coe_vars[symbol] = obj
+        # Add nothing -- gets us a subindex 0 and padding
+        obj.add()
+
+        for sis in parms['subindex']:
+            obj.subs.append( sis.eval(world, obj) )
+        obj.subs[0].default = obj.max_subindex()
+
+        return obj
+
+    def eval(self, world):
+        # world is some object with .last_index
+        statement_parms = self.parms
+
+        self.default_access = statement_parms.get('access',0)
+
+        base_symbol = statement_parms['symbol']
+
+        self.properties = {}
+        if 'property' in statement_parms:
+            for key,value in statement_parms['property']:
+                value = value.eval(world, defer=True)
+                self.properties[key] = value
+
+        if 'merge' in statement_parms:
+            objs = []
+            merge_len = len(statement_parms['merge'])
+            for i in xrange(merge_len):
+                spec = statement_parms['merge'][i]
+                symbol = '%s_%d' % (base_symbol, i)
+                obj = self.make_obj(world, symbol, statement_parms, spec)
+                obj.merge = merge_specification(objs, base_symbol, merge_len, i)
+                objs.append(obj)
+            return objs
+        else:
+            return self.make_obj(world, base_symbol, statement_parms, statement_parms)
+
+class eval_array():
+    def __init__(self, parms):
+        self.parms = parms
+    def eval(self, world):
+        # world is some object with .last_index
+        statement_parms = self.parms
+
+        btype = statement_parms['btype']
+        access = statement_parms.get('access',0)
+        if 'index' in statement_parms:
+            index = statement_parms['index'].eval(world)
+        else:
+            index = world.last_index+1
+        world.last_index = index
+        symbol = statement_parms['symbol']
+        if 'size' in statement_parms:
+            size = statement_parms['size'].eval(world)
+        else:
+            size = 0
+        description = statement_parms.get('description', 'Index %#04x'%index)
+
+        obj = coe_object(coe_object.oc_array, index, symbol, description)
+        obj.default_access = statement_parms.get('access',0)
+        world.coe_vars[symbol] = obj
+
+        default_values = []
+        for sis in statement_parms.get('values', ()):
+            default_values += sis.eval(world, defer=True)
+
+        if size > len(default_values):
+            default_values += [0]*(size-len(default_values))
+
+        obj.add(*default_values,access=access,index=index,btype=btype)
+
+        obj.properties = {}
+        if 'property' in statement_parms:
+            for key,value in statement_parms['property']:
+                value = value.eval(world, defer=True)
+                obj.properties[key] = value
+                add_coe_literal(world, '.'.join((symbol,key)), value)
+
+        return obj
+
+class eval_body():
+    def __init__(self, statements):
+        self.statements = statements
+    def eval(self, world):
+        for s in self.statements:
+            self.eval_statement(world, s)
+        with mesi_trace.span('resolve_deferred', 'eval'):
+            resolve_deferred(world)
+
+    def eval_statement(self, world, s):
+        with mesi_trace.span(s.__class__.__name__, 'eval', symbol=s.parms.get('symbol')):
+            obj = s.eval(world)
+        if obj:
+            try:
+                world.coe_dict.extend(obj)
+            except TypeError:
+                world.coe_dict.append(obj)
+
+def token_parms(tok):
+    """
+    Convert the named results of a parsed statement to the plain parameter
+    dict the eval_* classes take: expressions are expr_eval objects, lists
+    are python lists.
+    """
+    parms = tok.asDict()
+    for key in ('index', 'default', 'size'):
+        if key in parms:
+            parms[key] = parms[key][0]
+    if 'property' in parms:
+        parms['property'] = [(p['key'], p['value'][0]) for p in parms['property']]
+    if 'merge' in parms:
+        parms['merge'] = [token_parms(spec) for spec in parms['merge']]
+    for key in ('subindex', 'values', 'args'):
+        if key in parms:
+            parms[key] = list(parms[key])
+    return parms
+
+def statement_action(cls):
+    """Return a parse action building a cls statement from its tokens"""
+    def action(tok):
+        return cls(token_parms(tok))
+    return action
+
+class result_object():
+    """
+    Per-parse state: the symbol table and everything built from it.
+    filename is the parsed file, if known, and the remaining arguments are
+    the parse() options used for included files.
+    """
+    def __init__(self, filename=None, backend='pyparsing'):
+        self.filename = filename
+        self.parse_options = {'backend':backend}
+        # (path, digest) of all included files
+        self.includes = []
+        # real paths of the files being included, outermost first
+        self.include_stack = ()
+        # While compiling an included file: (path, stamp) of the files it
+        # includes
+        self.unit_stamps = None
+        self.last_index = 0x6000
+        self.coe_vars = symbol_table()
+        self.coe_dict = coe_dictionary()
+        self.make_list = []
+        self.settings = {}
+        # List of symbol references made during evaluation, or None to not
+        # record them (see read_reference)
+        self.reads = None
+        # deferred_references made since the last resolve_deferred()
+        self.deferred = []
+        # pdo_mapping of coe_dict, see pdo_mapping()
+        self._pdo_mapping = None
+        # Digest of coe_dict and make_list, see content_digest()
+        self._content_digest = None
+        # Results of memoize_on_content functions: digest -> {key: result}
+        self.memo = {}
+
+    def compact(self):
+        """
+        Switch the objects to columnar sub object storage, which takes a
+        fraction of the memory of sub object instances, and point the
+        symbol table at the rows which replace the sub objects it holds.
+        The objects are changed in place, so this is for results which are
+        not reused by an incremental_parser.
+        """
+        self.coe_dict.compact()
+        self.changed()
+        for symbol, so in self.coe_vars.items():
+            if type(so) is coe_sub_object:
+                row = self.coe_dict.find_sub(so.index, so.subindex)
+                if row is not None and row.symbol == so.symbol:
+                    self.coe_vars[symbol] = row
+
+    def pdo_mapping(self):
+        """
+        Return the pdo_mapping of coe_dict. It is resolved on first use,
+        once the dictionary is complete, and shared by all make modules.
+        """
+        if self._pdo_mapping is None:
+            self._pdo_mapping = pdo_mapping(self.coe_dict)
+        return self._pdo_mapping
+
+    def changed(self):
+        """
+        Forget what was derived from coe_dict, after modifying it (or after
+        code which may have). Memoized results stay in use if the content
+        turns out the same.
+        """
+        self._pdo_mapping = None
+        self._content_digest = None
+
+    def content_digest(self):
+        """
+        Digest of the objects, settings and make list. The objects and make
+        list are hashed once, so changed() must be called after modifying
+        coe_dict.
+        """
+        if self._content_digest is None:
+            h = hashlib.sha1()
+            for obj in frozen_objects(self.coe_dict):
+                h.update(obj.digest)
+            h.update(repr([(activity, tuple(args)) for activity, args in self.make_list]))
+            self._content_digest = h.digest()
+        h = hashlib.sha1(self._content_digest)
+        h.update(repr(sorted(self.settings.items())))
+        return h.hexdigest()
+
+    def update_settings(self):
+        """Derive settings from the symbol table"""
+        self.settings = dict((k,getattr(self.coe_vars[k],'default',0)) for k in self.coe_vars.keys())
+
+def memoize_on_content(fn):
+    """
+    Decorate fn(world, *args) to return the result of an earlier call with
+    args while world had the same content_digest(). The results are kept in
+    world.memo and shared by all such calls, so callers must not modify
+    them.
+    """
+    def memoized(world, *args):
+        digest = world.content_digest()
+        if digest not in world.memo:
+            # Results for earlier contents of world are not reused
+            world.memo = {digest: {}}
+        results = world.memo[digest]
+        key = (fn, args)
+        if key not in results:
+            results[key] = fn(world, *args)
+        return results[key]
+    memoized.__name__ = fn.__name__
+    memoized.__doc__ = fn.__doc__
+    return memoized
+
+class mesi_grammar():
+    """
+    The pyparsing grammar for .mesi files. Building the grammar is about as
+    costly as parsing a typical file, so it is built once (see grammar())
+    and shared. The parse actions only construct statement objects; all
+    per-parse state lives in the result_object handed to their eval(), so
+    one instance may be used from several threads.
+
+    pyparsing's packrat mode (ParserElement.enablePackrat()) does not pay
+    off for this grammar: the cache copies every ParseResults, and
+    mesi_bench.py -m packrat measures it at 0.5-0.6x the plain speed on
+    sources from 10 to 400 records. It is therefore not used.
+    """
+    def __init__(self):
+        # make keywords for CoE basic types, and match parametric types
+        # like STRING(16) by their pattern
+        PARAMETRIC_TYPE = Regex(r"(?:%s)\(\d+\)(?![A-Za-z0-9_$])" % '|'.join(parametric_types))
+        TYPE = PARAMETRIC_TYPE.setName('parametric type') | MatchFirst([Keyword(ct).setName(ct) for ct in sorted(builtin_btypes, key=len, reverse=True)])
+
+        # make keywords for CoE access modes
+        ACCESS = Group( ZeroOrMore( MatchFirst([Keyword(k) for k in access_bits.keys()]) ) )
+        ACCESS.setParseAction(eval_access)
+
+        RECORD = Keyword("record")
+
+        NAME = Word(alphas+"_", alphanums+"_.")
+        WILDNAME = Word(alphas+"_", alphanums+"_.*")
+        integer = Regex(r"[+-]?\d+").setParseAction(lambda tok: int(tok[0]))
+        real_value = Regex(r"[+-]?\d+\.\d+([eE][+-]?[0-9]+)?").setParseAction(lambda tok: float(tok[0]))
+        hex_integer = Regex(r"0x[0-9a-zA-Z]+").setParseAction(lambda tok: int(tok[0],16))
+
+        expr = MatchFirst([hex_integer, real_value, integer, "&" + NAME, "$" + NAME, NAME, dblQuotedString])
+        expr.setParseAction(expr_eval)
+        expr = Group( expr )
+
+        list_expr = delimitedList(MatchFirst([hex_integer, integer, Combine("&" + WILDNAME), Combine("$" + WILDNAME), WILDNAME]))
+        list_expr.setParseAction(list_expr_eval)
+        list_expr = Group( list_expr )
+
+        INDEX = Suppress('@') + expr("index")
+        STRING_LITERAL = dblQuotedString.copy().setParseAction(removeQuotes)
+        DESCRIPTION = Suppress(':') + STRING_LITERAL("description")
+        DEFAULT = EQUAL + expr("default")
+        PROPERTY = ZeroOrMore(Group(Suppress('.') + NAME("key") + EQUAL + expr("value")))("property")
+
+        MAKE_ARGS = ZeroOrMore( Word(alphanums+":!@#$%^()=+[]{}<>_./\\-") )
+        make_stmt = 'make' + NAME('module') + MAKE_ARGS('args') + SEMI;
+        make_stmt.setParseAction(statement_action(eval_make))
+
+        include_stmt = Keyword('include') + STRING_LITERAL('filename') + SEMI
+        include_stmt.setParseAction(statement_action(eval_include))
+
+        assign_stmt = NAME('symbol') + '=' + expr('default') + SEMI
+        assign_stmt.setParseAction(statement_action(eval_assign))
+
+        variable_statement = TYPE("btype") + ACCESS("access") + NAME("symbol") + ZeroOrMore(INDEX | DEFAULT | DESCRIPTION) + PROPERTY + SEMI;
+        subindex_statement = variable_statement.copy()
+        variable_statement.setParseAction(statement_action(eval_variable))
+        subindex_statement.setParseAction(statement_action(eval_subindex))
+
+        MERGE = delimitedList(Group(OneOrMore(INDEX | DESCRIPTION)))("merge")
+
+        record_statement = RECORD + ACCESS("access") + NAME("symbol") + ((LPAR + MERGE + RPAR) | ZeroOrMore(INDEX | DESCRIPTION)) + PROPERTY + Group(LBRACE + OneOrMore(subindex_statement) + RBRACE)("subindex") + SEMI
+        record_statement.setParseAction(statement_action(eval_record))
+
+        array_statement = TYPE("btype") + ACCESS("access") + NAME("symbol") + LBRACK + Optional(expr("size")) + RBRACK + ZeroOrMore(INDEX | DESCRIPTION) + PROPERTY + Optional(EQUAL + LBRACE + list_expr("values") + RBRACE) + SEMI
+        array_statement.setParseAction(statement_action(eval_array))
+
+        statement = Group( make_stmt | include_stmt | assign_stmt | variable_statement |
+            record_statement | array_statement )
+
+        body = ZeroOrMore(statement)
+        body.ignore(cppStyleComment).setParseAction(lambda tok: eval_body([s[0] for s in tok]))
+
+        # set parser element names
+        make_stmt.setName('make_stmt')
+        include_stmt.setName('include_stmt')
+        assign_stmt.setName('assign_stmt')
+        variable_statement.setName('variable_statement')
+        record_statement.setName('record_statement')
+        array_statement.setName('array_statement')
+        statement.setName('statement')
+        body.setName('body')
+
+        # pyparsing streamlines lazily on first use; do it now so that
+        # concurrent parses never modify the shared elements
+        body.streamline()
+
+        self.statement = statement
+        self.body = body
+
+    def parse_body(self, string):
+        """Parse string to an (unevaluated) eval_body"""
+        return self.body.parseString(string,parseAll=True)[0]
+
+_grammar = None
+_grammar_lock = threading.Lock()
+
+def grammar():
+    """Return the process wide mesi_grammar, building it on first use"""
+    global _grammar
+    if _grammar is None:
+        with _grammar_lock:
+            if _grammar is None:
+                _grammar = mesi_grammar()
+    return _grammar
+
+backends = ('pyparsing', 'rd')
+
+def parse(string, backend='pyparsing', filename=None):
+    """
+    Parse a mesi source string. backend selects the parser: 'pyparsing' for the grammar above, 'rd' for
+    the hand written parser in mesi_rd.py. Both give the same result.
+
+    filename is the name of the parsed file; include statements are
+    relative to its directory (or the current directory if None).
+    """
+    world = result_object(filename, backend)
+    with mesi_trace.span('syntax', 'parse', backend=backend):
+        body = parse_body(string, backend)
+    body.eval(world)
+    world.update_settings()
+    return world
+
+def parse_body(string, backend='pyparsing'):
+    """Parse string to an eval_body without evaluating it (see parse())"""
+    if backend == 'rd':
+        import mesi_rd
+        return mesi_rd.parse_body(string)
+    if backend != 'pyparsing':
+        raise ValueError("Unknown mesi parser backend '%s'" % backend)
+    return grammar().parse_body(string)
+
+# Comments and strings may hold ; or braces, so they are matched whole. An
+# unterminated block comment matches the last alternative.
+_boundary_re = re.compile(r'//(?:\\\n|[^\n])*|/\*.*?\*/|"(?:[^"\n\r\\]|\\.)*"|[{};]|/\*', re.S)
+
+def read_statements(fileobj):
+    """
+    Split the mesi source read line by line from fileobj at the top level ;
+    of each statement. Yields (offset, text) chunks as soon as they are
+    complete; text following the last statement (comments, or an
+    incomplete statement) is the last chunk.
+    """
+    buf = ''
+    offset = 0      # of buf in the source
+    pos = 0         # in buf, up to which boundaries have been scanned
+    depth = 0
+    for line in itertools.chain(fileobj, ('',)):
+        buf += line
+        eof = not line
+        m = _boundary_re.search(buf, pos)
+        while m:
+            c = m.group(0)
+            if not eof and (c == '/*' or (c.endswith('\\\n') and m.end() == len(buf))):
+                # The comment continues on lines not read yet
+                break
+            pos = m.end()
+            if c == '{':
+                depth += 1
+            elif c == '}':
+                depth -= 1
+            elif c == ';' and depth == 0:
+                yield offset, buf[:pos]
+                offset += pos
+                buf = buf[pos:]
+                pos = 0
+            m = _boundary_re.search(buf, pos)
+        else:
+            pos = len(buf)
+    if buf:
+        yield offset, buf
+
+def split_statements(string):
+    """Return the list of read_statements() chunks of the string source"""
+    return list(read_statements(cStringIO.StringIO(string)))
+
+def iter_statements(fileobj, backend=None, world=None):
+    """
+    Parse and evaluate the mesi source read from fileobj one top level
+    statement at a time. Yields what each statement adds as soon as it is
+    evaluated: its coe_objects, a make_object for a make statement and the
+    assign_objects of assignments and properties. Only the current
+    statement is parsed and held in memory; the symbol table still grows
+    with the source. References to symbols defined further down are
+    deferred_references in the yielded objects until fileobj is exhausted.
+
+    The statements are evaluated into world (a new result_object if None),
+    whose settings are updated once fileobj is exhausted. backend defaults
+    to that of the parse_options of world, or 'pyparsing'.
+    """
+    if world is None:
+        world = result_object(getattr(fileobj, 'name', None), backend or 'pyparsing')
+    backend = backend or world.parse_options['backend']
+    lineno = 1
+    col = 0
+    for offset, text in read_statements(fileobj):
+        try:
+            with mesi_trace.span('syntax', 'parse', backend=backend):
+                body = parse_body(text, backend)
+        except ParseBaseException, err:
+            # Pad the statement so that the error reports its line and
+            # column in the source
+            pad = '\n' * (lineno - 1) + ' ' * col
+            raise ParseException(pad + text, len(pad) + err.loc, err.msg)
+        newlines = text.count('\n')
+        if newlines:
+            lineno += newlines
+            col = len(text) - text.rindex('\n') - 1
+        else:
+            col += len(text)
+
+        for s in body.statements:
+            coe_dict_len = len(world.coe_dict)
+            make_list_len = len(world.make_list)
+            writes = world.coe_vars.journal = []
             try:
-                for sis in statement_parms['values']:
-                    default_values += sis.eval(obj)
-            except:
-                pass
-            
-            if size > len(default_values):
-                default_values += [0]*(size-len(default_values))
-            
-            obj.add(*default_values,access=access,index=index,btype=btype)
-            
-            obj.properties = {}            
-            if 'property' in statement_parms:
-                for prop in statement_parms['property']:
-                    key = prop['key']
-                    value = prop['value'][0].eval(self)
-                    obj.properties[key] = value
-                    add_coe_literal('.'.join((symbol,key)), value)
-
-            return obj
-    array_statement.setParseAction(eval_array)    
-    
-    statement = Group( make_stmt | assign_stmt | variable_statement | 
-        record_statement | array_statement )
-    
-    body = ZeroOrMore(statement)
-    class eval_body():
-        def __init__(self, tok):
-            self.values = tok
-            self.access = 0
-        def eval(self, result):
-            for s in self.values:
-                obj = s[0].eval(result)
-                if obj:
-                    try:
-                        result.coe_dict.extend(obj)
-                    except TypeError:
-                        result.coe_dict.append(obj)
-    body.ignore(cppStyleComment).setParseAction(eval_body)
-
-    class result_object():
-        def __init__(self):
-            self.last_index = 0x6000
-            self.coe_dict = []
-            self.make_list = []
-            self.settings = {}
-            
-    result = result_object()
-    
-    # set parser element names
-    for vname in ("make_stmt assign_stmt variable_statement record_statement "
-                  "array_statement statement body".split()):
-        v = vars()[vname]
-        v.setName(vname)
-        #v.setDebug()
-    
-    #~ for vname in "fundecl stmt".split():
-        #~ v = vars()[vname]
-        #~ v.setDebug()
-    body.parseString(string,parseAll=True)[0].eval(result)
-    result.settings = dict((k,getattr(coe_vars[k],'default',0)) for k in coe_vars.keys())    
-    
-    return result
+                body.eval_statement(world, s)
+            finally:
+                world.coe_vars.journal = None
+            for obj in world.coe_dict[coe_dict_len:]:
+                yield obj
+            for module, args in world.make_list[make_list_len:]:
+                yield make_object(module, args)
+            for symbol, obj in writes:
+                if isinstance(obj, assign_object):
+                    yield obj
+    resolve_deferred(world)
+    world.update_settings()
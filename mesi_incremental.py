@@ -0,0 +1,149 @@
+# -*- coding: utf-8 -*-
+"""
+mesi_incremental.py
+
+Incremental re-parsing of edited .mesi files. The source is split into its
+top level statements; a statement whose text and inputs are unchanged since
+the previous parse is not parsed or evaluated again, its recorded effect on
+the result is replayed instead.
+
+Created on Fri Oct 16 2026
+
+@copyright MIT License
+Copyright (C) 2013 Dynamic Systems Inc.
+Permission is hereby granted, free of charge, to any person obtaining 
+a copy of this software and associated documentation files (the 
+"Software"), to deal in the Software without restriction, including 
+without limitation the rights to use, copy, modify, merge, publish, 
+distribute, sublicense, and/or sell copies of the Software, and to 
+permit persons to whom the Software is furnished to do so, subject to 
+the following conditions:
+The above copyright notice and this permission notice shall be included 
+in all copies or substantial portions of the Software.
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS 
+OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, 
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL 
+THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR 
+OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, 
+ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR 
+OTHER DEALINGS IN THE SOFTWARE.
+"""
+
+import hashlib
+from pyparsing import ParseBaseException, ParseException
+import mesi_file
+
+def uses_last_index(statement):
+    """True if statement takes its index from the preceding object"""
+    parms = getattr(statement, 'parms', {})
+    if isinstance(statement, mesi_file.eval_record) and 'merge' in parms:
+        return any('index' not in spec for spec in parms['merge'])
+    if isinstance(statement, (mesi_file.eval_variable, mesi_file.eval_array, mesi_file.eval_record)):
+        return 'index' not in parms
+    return False
+
+class statement_record():
+    """The inputs and the effect of evaluating one top level statement"""
+    def __init__(self, statement, last_index):
+        self.uses_last_index = uses_last_index(statement)
+        self.last_index_in = last_index
+        self.last_index_out = last_index
+        self.reads = []         # (kind, mode, symbol, value) references
+        self.writes = []        # (symbol, object) symbol table assignments
+        self.objs = []          # objects added to coe_dict
+        self.makes = []         # entries added to make_list
+
+    def valid(self, world):
+        """True if the statement would evaluate the same way in world"""
+        if self.uses_last_index and world.last_index != self.last_index_in:
+            return False
+        for kind, mode, symbol, value in self.reads:
+            try:
+                if mesi_file.resolve_reference(world, kind, mode, symbol) != value:
+                    return False
+            except Exception:
+                return False
+        return True
+
+    def replay(self, world):
+        """Apply the recorded effect of the statement to world"""
+        for symbol, obj in self.writes:
+            world.coe_vars[symbol] = obj
+        world.coe_dict.extend(self.objs)
+        world.make_list.extend(self.makes)
+        world.last_index = self.last_index_out
+
+class incremental_parser():
+    """
+    Parses successive versions of a mesi source, evaluating only those
+    statements which changed, or which reference symbols whose values
+    changed. The result is the same as that of mesi_file.parse().
+
+    Objects of unchanged statements are shared between the results of
+    successive parses, so make modules which modify coe_dict objects see
+    the modifications made while processing a previous result.
+    """
+    def __init__(self, backend='pyparsing'):
+        self.backend = backend
+        # (fingerprint, occurrence) -> statement_record
+        self.records = {}
+        # Statistics of the last parse
+        self.evaluated = 0
+        self.reused = 0
+
+    def parse_chunk(self, string, offset, text):
+        try:
+            return mesi_file.parse_body(text, self.backend)
+        except ParseBaseException, err:
+            # Report the location within the whole source
+            raise ParseException(string, offset + err.loc, err.msg)
+
+    def evaluate(self, world, body):
+        """Evaluate the statements of body, recording their effect"""
+        records = []
+        for s in body.statements:
+            rec = statement_record(s, world.last_index)
+            coe_dict_len = len(world.coe_dict)
+            make_list_len = len(world.make_list)
+            world.reads = rec.reads
+            world.coe_vars.journal = rec.writes
+            try:
+                body.eval_statement(world, s)
+            finally:
+                world.reads = None
+                world.coe_vars.journal = None
+            rec.objs = world.coe_dict[coe_dict_len:]
+            rec.makes = world.make_list[make_list_len:]
+            rec.last_index_out = world.last_index
+            records.append(rec)
+        return records
+
+    def parse(self, string, filename=None):
+        """Parse string, reusing what is unchanged since the last call"""
+        world = mesi_file.result_object(filename, self.backend)
+        records = {}
+        occurrences = {}
+        self.evaluated = self.reused = 0
+
+        for offset, text in mesi_file.split_statements(string):
+            fingerprint = hashlib.sha1(text).digest()
+            key = (fingerprint, occurrences.get(fingerprint, 0))
+            occurrences[fingerprint] = key[1] + 1
+
+            # A chunk holds a single statement (or none, for trailing
+            # comments), unless odd make arguments fooled the splitter
+            recs = self.records.get(key)
+            if recs is not None and len(recs) <= 1 and all(r.valid(world) for r in recs):
+                for rec in recs:
+                    rec.replay(world)
+                records[key] = recs
+                self.reused += len(recs)
+                continue
+            recs = self.evaluate(world, self.parse_chunk(string, offset, text))
+            records[key] = recs
+            self.evaluated += len(recs)
+
+        mesi_file.resolve_deferred(world)
+        world.update_settings()
+        self.records = records
+        return world
@@ -0,0 +1,322 @@
+# -*- coding: utf-8 -*-
+"""
+mesi_rd.py
+
+Hand written tokenizer and recursive descent parser for .mesi files. This
+is an alternative to the pyparsing grammar in mesi_file.py: it follows the
+same grammar, builds the same eval_* statements and thus produces the same
+result_object, only much faster. It is selected by
+mesi_file.parse(string, backend='rd').
+
+Created on Fri Oct 16 2026
+
+@copyright MIT License
+Copyright (C) 2013 Dynamic Systems Inc.
+Permission is hereby granted, free of charge, to any person obtaining 
+a copy of this software and associated documentation files (the 
+"Software"), to deal in the Software without restriction, including 
+without limitation the rights to use, copy, modify, merge, publish, 
+distribute, sublicense, and/or sell copies of the Software, and to 
+permit persons to whom the Software is furnished to do so, subject to 
+the following conditions:
+The above copyright notice and this permission notice shall be included 
+in all copies or substantial portions of the Software.
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS 
+OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, 
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL 
+THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR 
+OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, 
+ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR 
+OTHER DEALINGS IN THE SOFTWARE.
+"""
+
+import re
+from pyparsing import ParseException
+from coe_defs import *
+from mesi_file import *
+
+# Longest type names first, so that e.g. USINT.16 is not read as USINT.
+# Parametric types like STRING(16) are matched by their pattern.
+_type_names = '|'.join([r'(?:%s)\(\d+\)' % '|'.join(parametric_types)] +
+    [re.escape(t) for t in sorted(builtin_btypes, key=len, reverse=True)])
+
+_token_re = re.compile(r'''
+    (?P<skip>\s+|//(?:\\\n|[^\n])*|/\*.*?\*/) |
+    (?P<type>(?:%s)(?![A-Za-z0-9_$])) |
+    (?P<hex>0x[0-9a-zA-Z]+) |
+    (?P<real>[+-]?\d+\.\d+(?:[eE][+-]?[0-9]+)?) |
+    (?P<int>[+-]?\d+) |
+    (?P<name>[A-Za-z_][A-Za-z0-9_.*]*) |
+    (?P<string>"(?:[^"\n\r\\]|\\.)*") |
+    (?P<punct>[@:=;,.{}()\[\]&$])
+    ''' % _type_names, re.X | re.S)
+
+_name_re = re.compile(r'[A-Za-z_][A-Za-z0-9_.]*$')
+_skip_re = re.compile(r'(?:\s+|//(?:\\\n|[^\n])*|/\*.*?\*/)*', re.S)
+_make_arg_re = re.compile(r'[A-Za-z0-9:!@#$%^()=+\[\]{}<>_./\\-]+')
+
+def is_name(kind, text, wild=False):
+    """True if the token is usable as a symbol (wild: may hold wildcards)"""
+    if kind == 'name':
+        return wild or '*' not in text
+    # type names are valid symbols outside of a type position
+    return kind == 'type' and _name_re.match(text) is not None
+
+class mesi_scanner():
+    """
+    Tokenizer for .mesi source. Tokens are produced on demand as
+    (kind, text, position) tuples with one token of lookahead; kind is one
+    of the group names of _token_re, or 'eof'.
+    """
+    def __init__(self, string):
+        self.string = string
+        self.pos = 0
+        self.tok = self.scan()
+
+    def scan(self):
+        string = self.string
+        while True:
+            m = _token_re.match(string, self.pos)
+            if m is None:
+                if self.pos >= len(string):
+                    return ('eof', '', self.pos)
+                self.error("Unexpected character %r" % string[self.pos], self.pos)
+            self.pos = m.end()
+            kind = m.lastgroup
+            if kind != 'skip':
+                return (kind, m.group(kind), m.start())
+
+    def peek(self):
+        return self.tok
+
+    def next(self):
+        tok = self.tok
+        self.tok = self.scan()
+        return tok
+
+    def rescan(self, pattern):
+        """
+        Match pattern at the current token, bypassing the tokenizer. Used for
+        make arguments, which are free form words. Returns the matched text,
+        or None.
+        """
+        pos = self.tok[2]
+        m = pattern.match(self.string, pos)
+        if m is None:
+            return None
+        self.pos = _skip_re.match(self.string, m.end()).end()
+        self.tok = self.scan()
+        return m.group(0)
+
+    def error(self, msg, pos=None):
+        if pos is None:
+            pos = self.tok[2]
+        raise ParseException(self.string, pos, msg)
+
+class mesi_rd_parser():
+    """
+    Recursive descent parser for .mesi files. Each parse_* method consumes
+    one production of the grammar documented in mesi_file.py and returns
+    the corresponding eval_* statement (or expression) object.
+    """
+    def __init__(self, string):
+        self.scanner = mesi_scanner(string)
+
+    # Token helpers
+    def peek(self):
+        return self.scanner.peek()
+
+    def accept(self, text):
+        """Consume the current token if it is the punctuation text"""
+        tok = self.scanner.peek()
+        if tok[0] == 'punct' and tok[1] == text:
+            self.scanner.next()
+            return True
+        return False
+
+    def expect(self, text):
+        if not self.accept(text):
+            self.scanner.error("Expected %r" % text)
+
+    def expect_name(self, wild=False):
+        kind, text, pos = self.scanner.peek()
+        if not is_name(kind, text, wild):
+            self.scanner.error("Expected symbol")
+        self.scanner.next()
+        return text
+
+    def expect_string(self):
+        kind, text, pos = self.scanner.peek()
+        if kind != 'string':
+            self.scanner.error("Expected quoted string")
+        self.scanner.next()
+        return text[1:-1]
+
+    def adjacent_name(self, prefix_pos, wild):
+        """Symbol which must directly follow a & or $ prefix"""
+        if self.peek()[2] != prefix_pos+1:
+            self.scanner.error("Expected symbol")
+        return self.expect_name(wild)
+
+    # Expressions
+    def parse_expr(self):
+        kind, text, pos = self.scanner.next()
+        if kind == 'hex':
+            value = int(text,16)
+        elif kind == 'real':
+            value = float(text)
+        elif kind == 'int':
+            value = int(text)
+        elif kind == 'string':
+            value = text
+        elif is_name(kind, text):
+            return expr_eval([text])
+        elif kind == 'punct' and text in '&$':
+            return expr_eval([text, self.expect_name()])
+        else:
+            self.scanner.error("Expected expression", pos)
+        return expr_eval([value])
+
+    def parse_list_expr(self):
+        values = []
+        while True:
+            kind, text, pos = self.scanner.next()
+            if kind == 'hex':
+                values.append(int(text,16))
+            elif kind == 'int':
+                values.append(int(text))
+            elif is_name(kind, text, True):
+                values.append(text)
+            elif kind == 'punct' and text in '&$':
+                values.append(text + self.adjacent_name(pos, True))
+            else:
+                self.scanner.error("Expected list element", pos)
+            if not self.accept(','):
+                return list_expr_eval(values)
+
+    def parse_access(self):
+        names = []
+        while self.peek()[0] == 'name' and self.peek()[1] in access_bits:
+            names.append(self.scanner.next()[1])
+        return access_field(names)
+
+    def parse_specifiers(self, parms, allowed):
+        """Parse any of @index, =default and :description"""
+        while True:
+            if '@' in allowed and self.accept('@'):
+                parms['index'] = self.parse_expr()
+            elif '=' in allowed and self.accept('='):
+                parms['default'] = self.parse_expr()
+            elif ':' in allowed and self.accept(':'):
+                parms['description'] = self.expect_string()
+            else:
+                return parms
+
+    def parse_properties(self, parms):
+        props = []
+        while self.accept('.'):
+            key = self.expect_name()
+            self.expect('=')
+            props.append((key, self.parse_expr()))
+        if props:
+            parms['property'] = props
+        return parms
+
+    # Statements
+    def parse_statement(self):
+        kind, text, pos = self.scanner.next()
+        nkind, ntext, npos = self.peek()
+        if nkind == 'punct' and ntext == '=':
+            if not is_name(kind, text):
+                self.scanner.error("Expected statement", pos)
+            self.scanner.next()
+            parms = {'symbol':text, 'default':self.parse_expr()}
+            self.expect(';')
+            return eval_assign(parms)
+        if kind == 'type':
+            return self.parse_variable_or_array(text)
+        if kind == 'name' and text == 'make':
+            return self.parse_make()
+        if kind == 'name' and text == 'include' and nkind == 'string':
+            parms = {'filename':self.expect_string()}
+            self.expect(';')
+            return eval_include(parms)
+        if kind == 'name' and text == 'record':
+            return self.parse_record()
+        self.scanner.error("Expected statement", pos)
+
+    def parse_make(self):
+        parms = {'module':self.expect_name()}
+        args = []
+        while True:
+            arg = self.scanner.rescan(_make_arg_re)
+            if arg is None:
+                break
+            args.append(arg)
+        if args:
+            parms['args'] = args
+        self.expect(';')
+        return eval_make(parms)
+
+    def parse_variable_or_array(self, btype):
+        parms = {'btype':btype, 'access':self.parse_access(), 'symbol':self.expect_name()}
+        if self.accept('['):
+            if not self.accept(']'):
+                parms['size'] = self.parse_expr()
+                self.expect(']')
+            self.parse_specifiers(parms, '@:')
+            self.parse_properties(parms)
+            if self.accept('='):
+                self.expect('{')
+                parms['values'] = [self.parse_list_expr()]
+                self.expect('}')
+            self.expect(';')
+            return eval_array(parms)
+        self.parse_specifiers(parms, '@=:')
+        self.parse_properties(parms)
+        self.expect(';')
+        return eval_variable(parms)
+
+    def parse_subindex(self):
+        kind, btype, pos = self.scanner.next()
+        if kind != 'type':
+            self.scanner.error("Expected basic type", pos)
+        parms = {'btype':btype, 'access':self.parse_access(), 'symbol':self.expect_name()}
+        self.parse_specifiers(parms, '@=:')
+        self.parse_properties(parms)
+        self.expect(';')
+        return eval_subindex(parms)
+
+    def parse_record(self):
+        parms = {'access':self.parse_access(), 'symbol':self.expect_name()}
+        if self.accept('('):
+            merge = []
+            while True:
+                spec = self.parse_specifiers({}, '@:')
+                if not spec:
+                    self.scanner.error("Expected index or description")
+                merge.append(spec)
+                if not self.accept(','):
+                    break
+            self.expect(')')
+            parms['merge'] = merge
+        else:
+            self.parse_specifiers(parms, '@:')
+        self.parse_properties(parms)
+        self.expect('{')
+        subs = [self.parse_subindex()]
+        while not self.accept('}'):
+            subs.append(self.parse_subindex())
+        parms['subindex'] = subs
+        self.expect(';')
+        return eval_record(parms)
+
+    def parse_body(self):
+        statements = []
+        while self.peek()[0] != 'eof':
+            statements.append(self.parse_statement())
+        return eval_body(statements)
+
+def parse_body(string):
+    """Parse string to an (unevaluated) eval_body"""
+    return mesi_rd_parser(string).parse_body()
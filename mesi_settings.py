@@ -157,12 +157,13 @@ def set_default(settings, dest, src):
     if dest not in settings:
         settings[dest] = settings[src]
 
-def get_mapped_subobjects(coe_dict, map_addr):
-    subs = []
-    for pdo_map_entry in (obj for obj in coe_dict if (obj.index&0xff00)==map_addr):
-        for mso in pdo_map_entry.subs[1:]:
-            subs.append(find_by_map_loc(coe_dict,mso.default))
-    return subs
+# Parts of world read and written by make() (see mesi_build.py)
+reads = ('settings', 'coe_dict')
+writes = ('settings',)
+
+def outputs(world, *args):
+    """Files written by make(world, *args): none, settings only"""
+    return []
 
 def make(world, *args):
     # Essentially, many of the settings are stolen from the ecat_def header 
@@ -235,11 +236,9 @@ def make(world, *args):
     set_default_val(settings,'DEVICE_HW_VERSION_LEN',len(settings['DEVICE_HW_VERSION']))
     set_default_val(settings,'DEVICE_SW_VERSION_LEN',len(settings['DEVICE_SW_VERSION']))
     
-    rx_pdos = get_mapped_subobjects(world.coe_dict, 0x1600)
-    tx_pdos = get_mapped_subobjects(world.coe_dict, 0x1a00)
-    
-    rx_pdo_bytes = (sum(so.pdo_bitsize() for so in rx_pdos)+7)/8   
-    tx_pdo_bytes = (sum(so.pdo_bitsize() for so in tx_pdos)+7)/8   
+    mapping = world.pdo_mapping()
+    rx_pdo_bytes = (mapping.bitsize(pdo_mapping.rx_maps)+7)/8
+    tx_pdo_bytes = (mapping.bitsize(pdo_mapping.tx_maps)+7)/8
     
     set_default_val(settings,'MAX_PD_OUTPUT_SIZE',rx_pdo_bytes)
     set_default_val(settings,'MAX_PD_INPUT_SIZE',tx_pdo_bytes)
@@ -249,4 +248,4 @@ def make(world, *args):
         settings['ECAT_TIMER_INT'] else 0)
   
     
-    
\ No newline at end of file
+    
\ No newline at end of file
@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+"""
+mesi_timing.py
+
+The cost of the phases of a mesicat run: the parse of each file and each
+of its make steps, as wall time, CPU time and peak memory. Phases may be
+profiled with cProfile, and the timings written as a JSON report.
+Created on Fri Oct 16 2026
+
+@copyright MIT License
+Copyright (C) 2013 Dynamic Systems Inc.
+Permission is hereby granted, free of charge, to any person obtaining
+a copy of this software and associated documentation files (the
+"Software"), to deal in the Software without restriction, including
+without limitation the rights to use, copy, modify, merge, publish,
+distribute, sublicense, and/or sell copies of the Software, and to
+permit persons to whom the Software is furnished to do so, subject to
+the following conditions:
+The above copyright notice and this permission notice shall be included
+in all copies or substantial portions of the Software.
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR
+OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE,
+ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+OTHER DEALINGS IN THE SOFTWARE.
+"""
+
+import os
+import sys
+import time
+import json
+import cProfile
+import collections
+import mesi_file
+try:
+    import resource
+except ImportError:
+    # Not available on Windows, where peak memory is not reported
+    resource = None
+
+# Layout of the JSON report
+report_version = 1
+
+# One phase of a run. wall and cpu are in seconds; peak is the peak
+# resident memory in kB of the process while it ran the phase (None where
+# unknown, see reset_peak_memory). Steps which were up to date were only
+# replayed.
+phase_timing = collections.namedtuple('phase_timing',
+    'filename phase wall cpu peak up_to_date')
+
+def cpu_time():
+    """User and system CPU seconds used by this process"""
+    user, system = os.times()[:2]
+    return user + system
+
+def peak_memory():
+    """Peak resident memory of this process in kB, None if unknown"""
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Bytes on Mac OS X, kB elsewhere
+    return rss / 1024 if sys.platform == 'darwin' else rss
+
+def reset_peak_memory():
+    """
+    Restart the peak resident memory of this process from its current size,
+    so that peak_memory() reports the peak since. Only Linux allows this;
+    returns False elsewhere.
+    """
+    if resource is None:
+        return False
+    try:
+        with open('/proc/self/clear_refs', 'w') as outfile:
+            outfile.write('5')
+    except (IOError, OSError):
+        return False
+    return True
+
+def profile_path(filename, phase, number=None):
+    """File for the cProfile statistics of a phase of filename"""
+    if number is None:
+        return '%s.%s.prof' % (filename, phase)
+    return '%s.%d.%s.prof' % (filename, number, phase)
+
+def measure(filename, phase, profile, fn, *args):
+    """
+    Call fn(*args), returning its result and its phase_timing. If profile
+    is a path, the cProfile statistics of the call are written there.
+    """
+    profiler = cProfile.Profile() if profile else None
+    # Otherwise peak_memory() is the peak of all phases so far
+    peak_known = reset_peak_memory()
+    wall, cpu = time.time(), cpu_time()
+    if profiler:
+        result = profiler.runcall(fn, *args)
+    else:
+        result = fn(*args)
+    timing = phase_timing(filename, phase, time.time() - wall, cpu_time() - cpu,
+        peak_memory() if peak_known else None, False)
+    if profiler:
+        profiler.dump_stats(profile)
+    return result, timing
+
+def format_timings(timings):
+    """The timings as a table, one line per phase"""
+    width = max([len(t.filename) for t in timings] + [4])
+    phase_width = max([len(t.phase) for t in timings] + [5])
+    lines = ['%-*s  %-*s %9s %9s %10s' % (width, 'file', phase_width, 'phase',
+        'wall s', 'cpu s', 'peak kB')]
+    for t in timings:
+        lines.append('%-*s  %-*s %9.3f %9.3f %10s%s' % (width, t.filename,
+            phase_width, t.phase, t.wall, t.cpu, '-' if t.peak is None else t.peak,
+            '  up to date' if t.up_to_date else ''))
+    return '\n'.join(lines)
+
+def write_report(path, timings):
+    """Write the timings to path as JSON, for tools tracking regressions"""
+    report = {
+        'version': report_version,
+        'mesicat': mesi_file.__version__,
+        'phases': [t._asdict() for t in timings],
+    }
+    with open(path, 'w') as outfile:
+        json.dump(report, outfile, indent=2, sort_keys=True, separators=(',', ': '))
+        outfile.write('\n')
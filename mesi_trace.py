@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+"""
+mesi_trace.py
+
+Spans of a mesicat run in the Chrome trace event format, for viewing in
+chrome://tracing or a compatible viewer. Code marks a span with
+
+    with mesi_trace.span(name, category, key=value, ...):
+        ...
+
+which costs next to nothing unless tracing was started. Worker processes
+hand the events they collect back to the main process (see take()),
+which writes them all to one file.
+Created on Fri Oct 16 2026
+
+@copyright MIT License
+Copyright (C) 2013 Dynamic Systems Inc.
+Permission is hereby granted, free of charge, to any person obtaining
+a copy of this software and associated documentation files (the
+"Software"), to deal in the Software without restriction, including
+without limitation the rights to use, copy, modify, merge, publish,
+distribute, sublicense, and/or sell copies of the Software, and to
+permit persons to whom the Software is furnished to do so, subject to
+the following conditions:
+The above copyright notice and this permission notice shall be included
+in all copies or substantial portions of the Software.
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR
+OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE,
+ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+OTHER DEALINGS IN THE SOFTWARE.
+"""
+
+import os
+import time
+import json
+import thread
+
+# The events collected by this process while tracing, else None
+events = None
+
+def start():
+    """Start collecting events"""
+    global events
+    if events is None:
+        events = []
+
+def clear():
+    """Forget the events collected, e.g. by the parent of a forked worker"""
+    if events is not None:
+        del events[:]
+
+def take():
+    """Return and forget the events collected so far"""
+    if events is None:
+        return []
+    taken = events[:]
+    del events[:]
+    return taken
+
+def add(more):
+    """Add the events taken in another process"""
+    if events is not None:
+        events.extend(more)
+
+class _span(object):
+    """A complete ('X') event, recorded when the with block exits"""
+    __slots__ = ('name', 'category', 'args', 'start')
+    def __init__(self, name, category, args):
+        self.name = name
+        self.category = category
+        self.args = args
+    def __enter__(self):
+        self.start = time.time()
+        return self
+    def __exit__(self, *exc_info):
+        end = time.time()
+        if events is not None:
+            events.append({'name': self.name, 'cat': self.category, 'ph': 'X',
+                'ts': self.start * 1e6, 'dur': (end - self.start) * 1e6,
+                'pid': os.getpid(), 'tid': thread.get_ident(), 'args': self.args})
+
+class _null_span(object):
+    """Stands in for a _span while not tracing"""
+    __slots__ = ()
+    def __enter__(self):
+        return self
+    def __exit__(self, *exc_info):
+        pass
+
+_no_span = _null_span()
+
+def span(name, category, **args):
+    """Context manager recording the time spent in its block as an event"""
+    if events is None:
+        return _no_span
+    return _span(name, category, args)
+
+def write(path, trace_events, main_pid=None):
+    """
+    Write trace_events to path as a Chrome trace, naming the process
+    main_pid (this one if None) mesicat and the others workers
+    """
+    if main_pid is None:
+        main_pid = os.getpid()
+    base = min([e['ts'] for e in trace_events] or [0])
+    out = []
+    for pid in sorted(set(e['pid'] for e in trace_events)):
+        name = 'mesicat' if pid == main_pid else 'mesicat worker'
+        out.append({'name': 'process_name', 'ph': 'M', 'pid': pid, 'tid': 0,
+            'args': {'name': name}})
+    for e in trace_events:
+        e = dict(e)
+        # Relative times keep the microseconds exact in the JSON
+        e['ts'] = round(e['ts'] - base, 1)
+        e['dur'] = round(e['dur'], 1)
+        out.append(e)
+    with open(path, 'w') as outfile:
+        json.dump({'traceEvents': out, 'displayTimeUnit': 'ms'}, outfile,
+            separators=(',', ':'))
+        outfile.write('\n')
@@ -30,46 +30,235 @@ ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
 OTHER DEALINGS IN THE SOFTWARE.
 """
 import sys
+import os
+import glob
 import getopt
 import importlib
+import multiprocessing
+import traceback
 import mesi_file
+import mesi_cache
+import mesi_build
+import mesi_timing
+import mesi_trace
+import coe_defs
 
 def usage():
-    print sys.argv[0], "[-v] file.mesi"
+    print sys.argv[0], "[-v] [-B] [-b %s] [-j jobs] [--no-cache] [--cache-dir=dir] [--compact] [--date-epoch=seconds] [--timings] [--timings-json=file] [--profile] [--trace=file] file.mesi|dir ..." % '|'.join(mesi_file.backends)
+    print sys.argv[0], "--diff [-b %s] [--no-cache] [--cache-dir=dir] old.mesi new.mesi" % '|'.join(mesi_file.backends)
+
+def mesi_files(paths):
+    """Expand the directories among paths to the .mesi files they hold"""
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files += sorted(glob.glob(os.path.join(path, '*.mesi')))
+        else:
+            files.append(path)
+    return files
+
+def error_message(err, verbose):
+    """Message for the exception err being handled, a traceback if verbose"""
+    if verbose:
+        message = traceback.format_exc()
+    else:
+        message = ''.join(traceback.format_exception_only(type(err), err))
+    return message.strip()
+
+def parse_file(job):
+    """
+    Parse one file, in a worker process if main() runs several jobs.
+    Returns (filename, world, None, timing, events), or (filename, None,
+    error message, None, events), where timing is the phase_timing of the
+    parse (see mesi_timing), which is profiled if so requested, and events
+    the trace events of the parse (see mesi_trace).
+    """
+    filename, backend, use_cache, cache_dir, compact, verbose, profile = job
+    def parse():
+        with mesi_trace.span('parse', 'parse', file=filename):
+            if use_cache:
+                with mesi_trace.span('read', 'io', path=filename):
+                    with open(filename,'r') as infile:
+                        source = infile.read()
+                cache = mesi_cache.parse_cache(cache_dir)
+                world = cache.parse(source, backend=backend, filename=filename)
+            else:
+                # Nothing to hash, so the file is parsed as it is read
+                world = mesi_file.result_object(filename, backend)
+                with open(filename,'r') as infile:
+                    for obj in mesi_file.iter_statements(infile, backend=backend, world=world):
+                        pass
+            if compact:
+                world.compact()
+        return world
+    try:
+        world, timing = mesi_timing.measure(filename, 'parse',
+            profile and mesi_timing.profile_path(filename, 'parse'), parse)
+        return filename, world, None, timing, mesi_trace.take()
+    except Exception, err:
+        return filename, None, error_message(err, verbose), None, mesi_trace.take()
+
+def make_outputs(world):
+    """Real paths of the files written by the make statements of world"""
+    outputs = []
+    for activity, args in world.make_list:
+        mod = importlib.import_module(activity)
+        if hasattr(mod, 'outputs'):
+            outputs += [os.path.realpath(f) for f in mod.outputs(world, *args)]
+    return outputs
+
+def diff_files(old_job, new_job):
+    """
+    Print the changes to the object dictionary from the file of old_job to
+    that of new_job (see parse_file). Returns the exit status: 0 if the
+    dictionaries are the same, 1 if they differ, 2 on error.
+    """
+    worlds = []
+    for job in (old_job, new_job):
+        filename, world, error, timing, events = parse_file(job)
+        if world is None:
+            print >>sys.stderr, '%s: %s' % (filename, error)
+            return 2
+        worlds.append(world)
+    changes = coe_defs.diff_dicts(worlds[0].coe_dict, worlds[1].coe_dict)
+    for change in changes:
+        print coe_defs.format_change(change)
+    return 1 if changes else 0
 
 def main():
     verbose = False
+    backend = 'pyparsing'
+    use_cache = True
+    cache_dir = None
+    jobs = 1
+    compact = False
+    diff = False
+    force = False
+    timings = None
+    report = None
+    profile = False
+    trace = None
     
     try:
-        opts, args = getopt.getopt(sys.argv[1:], "v")
+        opts, args = getopt.getopt(sys.argv[1:], "vBb:j:", ["no-cache", "cache-dir=", "compact", "diff", "date-epoch=",
+            "timings", "timings-json=", "profile", "trace="])
     except getopt.GetoptError, err:
         # print help information and exit:
         print str(err) # will print something like "option -a not recognized"
         usage()
         sys.exit(2)
         
-    if len(args) != 1:
+    if len(args) < 1:
         usage()
         sys.exit(1)
 
     for o, a in opts:
         if o == "-v":
             verbose = True
+        elif o == "-B":
+            # Run all make statements, even those which are up to date
+            force = True
+        elif o == "-b":
+            if a not in mesi_file.backends:
+                usage()
+                sys.exit(2)
+            backend = a
+        elif o == "-j":
+            jobs = int(a)
+        elif o == "--no-cache":
+            use_cache = False
+        elif o == "--cache-dir":
+            cache_dir = a
+        elif o == "--compact":
+            compact = True
+        elif o == "--diff":
+            diff = True
+        elif o == "--date-epoch":
+            # Reproducible builds: stamp this date rather than today's on
+            # the generated files (see coe_gen_c.build_date)
+            os.environ['SOURCE_DATE_EPOCH'] = str(int(a))
+        elif o == "--timings":
+            timings = []
+        elif o == "--timings-json":
+            # The timings as JSON, for CI to track
+            report = a
+        elif o == "--profile":
+            # A cProfile dump per phase, see mesi_timing.profile_path
+            profile = True
+        elif o == "--trace":
+            # Chrome trace events of the run, see mesi_trace
+            trace = a
         else:
             assert False, "unhandled option"
 
-    with open(args[0],'r') as infile:
-        world = mesi_file.parse(infile.read())
-    
-    # Handy dump of defined objects
-    if verbose:
-        for obj in world.coe_dict:
-            print obj
-        
-    for activity, args in world.make_list:
-        print 'Make %s(%s):' % (activity, ','.join(args))
-        mod = importlib.import_module(activity)
-        mod.make(world, *args)
+    if diff:
+        if len(args) != 2:
+            usage()
+            sys.exit(2)
+        sys.exit(diff_files(*[(f, backend, use_cache, cache_dir, False, verbose, False) for f in args]))
+
+    files = mesi_files(args)
+    job_list = [(f, backend, use_cache, cache_dir, compact, verbose, profile) for f in files]
+    if trace:
+        mesi_trace.start()
+    if jobs > 1 and len(files) > 1:
+        pool = multiprocessing.Pool(min(jobs, len(files)), mesi_trace.clear)
+        try:
+            results = pool.map(parse_file, job_list)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        results = map(parse_file, job_list)
+
+    # Files which would overwrite each other's outputs
+    written = {}
+    for filename, world, error, timing, events in results:
+        mesi_trace.add(events)
+        if world is None:
+            continue
+        for path in set(make_outputs(world)):
+            written.setdefault(path, []).append(filename)
+    collisions = sorted((path, names) for path, names in written.iteritems() if len(names) > 1)
+    for path, names in collisions:
+        print >>sys.stderr, 'Error: %s is written by %s' % (path, ', '.join(names))
+    if collisions:
+        sys.exit(1)
+
+    measured = [] if timings is not None or report else None
+    failed = 0
+    for filename, world, error, timing, events in results:
+        if len(files) > 1:
+            print '%s:' % filename
+        if world is None:
+            print >>sys.stderr, '%s: %s' % (filename, error)
+            failed += 1
+            continue
+        if measured is not None:
+            measured.append(timing)
+
+        # Handy dump of defined objects
+        if verbose:
+            for obj in world.coe_dict:
+                print obj
+            
+        try:
+            mesi_build.make(world, filename, force=force, jobs=jobs,
+                timings=measured, profile=profile)
+        except Exception, err:
+            print >>sys.stderr, '%s: %s' % (filename, error_message(err, verbose))
+            failed += 1
+
+    if len(files) > 1:
+        print '%d files, %d failed' % (len(files), failed)
+    if timings is not None and measured:
+        print mesi_timing.format_timings(measured)
+    if report:
+        mesi_timing.write_report(report, measured)
+    if trace:
+        mesi_trace.write(trace, mesi_trace.take())
+    if failed:
+        sys.exit(1)
   
 if __name__ == '__main__':
     main()
@@ -13,5 +13,5 @@ setup(name='mesicat',
       author_email='dave.page@gleeble.com',
       url='https://sourceforge.net/p/mesicat/',
       py_modules=['mesicat','coe_defs','coe_gen_c','coe_gen_sii','coe_gen_xml',
-                  'ethercatinfo','mesi_file','mesi_settings'],
-      )
\ No newline at end of file
+                  'ethercatinfo','mesi_build','mesi_cache','mesi_file','mesi_incremental','mesi_rd','mesi_settings','mesi_timing','mesi_trace'],
+      )
\ No newline at end of file
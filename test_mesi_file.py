@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+"""
+test_mesi_file.py
+
+Tests of mesi source parsing, run against both parser backends with
+python -m unittest test_mesi_file
+Created on Fri Oct 16 2026
+
+@copyright MIT License
+Copyright (C) 2013 Dynamic Systems Inc.
+Permission is hereby granted, free of charge, to any person obtaining
+a copy of this software and associated documentation files (the
+"Software"), to deal in the Software without restriction, including
+without limitation the rights to use, copy, modify, merge, publish,
+distribute, sublicense, and/or sell copies of the Software, and to
+permit persons to whom the Software is furnished to do so, subject to
+the following conditions:
+The above copyright notice and this permission notice shall be included
+in all copies or substantial portions of the Software.
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR
+OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE,
+ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+OTHER DEALINGS IN THE SOFTWARE.
+"""
+
+import types
+import unittest
+import mesi_file
+import mesi_build
+
+def parse(source):
+    """Parse source with each backend, returning the worlds"""
+    return [mesi_file.parse(source, backend=backend) for backend in mesi_file.backends]
+
+class pdo_map_entry_test(unittest.TestCase):
+    source = """
+record read tx_pdo_mapping rec @0x6000 { STRING(%d) text; };
+UDINT read rec_map[] @0x1a00 = { &rec.* };
+"""
+
+    def test_string_fits(self):
+        for world in parse(self.source % 31):
+            self.assertEqual(world.coe_dict.find(0x1a00).subs[1].default, 0x600001f8)
+
+    def test_string_too_large(self):
+        for backend in mesi_file.backends:
+            self.assertRaises(ValueError, mesi_file.parse, self.source % 32, backend=backend)
+
+class int64_default_test(unittest.TestCase):
+    source = """
+ULINT read big @0x2000 = 0xffffffffffffffff;
+LINT read small @0x2001 = -9223372036854775808;
+"""
+
+    def test_defaults(self):
+        for world in parse(self.source):
+            big, small = [world.coe_dict.find(index).subs[0] for index in (0x2000, 0x2001)]
+            self.assertEqual(big.default, 2**64 - 1)
+            self.assertEqual(small.default, -2**63)
+            self.assertEqual(big.c_default(), '0xffffffffffffffffULL')
+            self.assertEqual(small.c_default(), '(-0x7fffffffffffffffLL - 1)')
+
+    def test_array_defaults(self):
+        for world in parse('ULINT read arr[] @0x2000 = { 0xffffffffffffffff, 1 };'):
+            subs = world.coe_dict.find(0x2000).subs
+            self.assertEqual([so.default for so in subs[1:]], [2**64 - 1, 1])
+            self.assertEqual(subs[2].c_default(), '1ULL')
+
+class memoize_test(unittest.TestCase):
+    def setUp(self):
+        self.calls = []
+        def defaults(world):
+            self.calls.append(world)
+            return [obj.subs[0].default for obj in world.coe_dict]
+        self.defaults = mesi_file.memoize_on_content(defaults)
+
+    def test_reused(self):
+        world = mesi_file.parse('UINT read v @0x2000 = 1;')
+        self.assertEqual(self.defaults(world), [1])
+        world.changed()
+        self.assertEqual(self.defaults(world), [1])
+        self.assertEqual(len(self.calls), 1)
+
+    def test_step_changes_objects(self):
+        # A module may change the objects without declaring it
+        def make(world):
+            world.coe_dict[0].subs[0].default = 2
+        mod = types.ModuleType('edit_defaults')
+        mod.make, mod.reads, mod.writes = make, ('coe_dict',), ()
+        world = mesi_file.parse('UINT read v @0x2000 = 1;')
+        self.assertEqual(self.defaults(world), [1])
+        mesi_build.run_step(world, mod, ())
+        self.assertEqual(self.defaults(world), [2])
+
+if __name__ == '__main__':
+    unittest.main()